@@ -0,0 +1,372 @@
+'''
+Load test / benchmark for the API.
+
+Seeds a SQLite database through models.py, then drives the app with a mix
+of scenarios from `--concurrency` concurrent clients and reports p50/p95/p99
+latency and throughput per scenario:
+
+    python benchmark.py                                 # in-process (httpx ASGI transport)
+    python benchmark.py --uvicorn                       # against a local uvicorn process
+    python benchmark.py --url http://127.0.0.1:8000 --db blogdb.sqlite3 --no-seed
+
+    python benchmark.py --out before.json
+    python benchmark.py --out after.json --compare before.json
+
+Runs are reproducible for a given --seed: the same data, the same request
+sequence per client. Results are saved as JSON together with the commit they
+were measured on. The database is created from scratch unless --no-seed is
+given, so never point --db at data you want to keep.
+'''
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+PASSWORD = "benchmark"
+
+SCENARIOS = ("feed", "get", "like", "comment", "login")
+DEFAULT_MIX = "feed=40,get=30,like=10,comment=10,login=10"
+
+
+# seeding
+
+def seed(args):
+    # imported here: DATABASE_URL must be set before database.py is loaded
+    from sqlalchemy import insert
+
+    from database import SessionLocal, engine
+    import counters
+    import models
+    from passwords import pwd_context
+
+    rng = random.Random(args.seed)
+    # a new file rather than drop_all: that would keep schema_migrations and
+    # blog_fts, and the migrations would skip filling the read models
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+    models.Base.metadata.create_all(engine)
+
+    password = pwd_context().hash(PASSWORD)       # one hash shared by every user
+    now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    started = time.perf_counter()
+
+    with SessionLocal() as db:
+        def bulk(table, rows):
+            for i in range(0, len(rows), 5000):
+                db.execute(insert(table), rows[i:i + 5000])
+
+        bulk(models.User.__table__, [
+            {"username": f"user{i}", "email": f"user{i}@example.com", "password": password}
+            for i in range(1, args.users + 1)
+        ])
+        bulk(models.Category.__table__, [{"name": f"category{i}"} for i in range(1, args.categories + 1)])
+        bulk(models.Tag.__table__, [{"name": f"tag{i}"} for i in range(1, args.tags + 1)])
+
+        blogs = []
+        for i in range(1, args.blogs + 1):
+            created = now - timedelta(minutes=rng.randrange(365 * 24 * 60))
+            blogs.append({
+                "title": f"post {i} about tag{rng.randint(1, args.tags)}",
+                "body": " ".join(f"word{rng.randrange(1000)}" for _ in range(rng.randint(20, 200))),
+                "author_id": rng.randint(1, args.users),
+                "category_id": rng.randint(1, args.categories) if rng.random() < 0.9 else None,
+                "time_created": created,
+                "time_updated": created,
+            })
+        bulk(models.Blog.__table__, blogs)
+        bulk(models.blog_tag, [
+            {"blog_id": blog_id, "tag_id": tag_id}
+            for blog_id in range(1, args.blogs + 1)
+            for tag_id in rng.sample(range(1, args.tags + 1), min(args.tags, rng.randint(0, 5)))
+        ])
+
+        bulk(models.Comment.__table__, [
+            {"body": f"comment {i}", "commenter_id": rng.randint(1, args.users), "blog_id": rng.randint(1, args.blogs)}
+            for i in range(args.comments)
+        ])
+
+        def pairs(count):
+            # distinct (user, blog) pairs
+            seen = set()
+            while len(seen) < min(count, args.users * args.blogs):
+                seen.add((rng.randint(1, args.users), rng.randint(1, args.blogs)))
+            return sorted(seen)
+
+        bulk(models.Like.__table__, [{"reactor_id": user_id, "blog_id": blog_id} for user_id, blog_id in pairs(args.likes)])
+        bulk(models.History.__table__, [
+            {"user_id": user_id, "blog_id": blog_id, "viewed_at": now - timedelta(minutes=rng.randrange(30 * 24 * 60))}
+            for user_id, blog_id in pairs(args.history)
+        ])
+        db.commit()
+
+    counters.reconcile()
+    engine.dispose()
+    print(f"seeded {args.db} in {time.perf_counter() - started:.1f}s")
+
+
+# load
+
+class Client:
+
+    def __init__(self, http, username, token, rng, args):
+        self.http = http
+        self.username = username
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.rng = rng
+        self.args = args
+
+    def blog_id(self):
+        return self.rng.randint(1, self.args.blogs)
+
+    async def feed(self):
+        kind = self.rng.random()
+        if kind < 0.5:
+            params = {"limit": 10}
+        elif kind < 0.75:
+            params = {"limit": 10, "category": f"category{self.rng.randint(1, self.args.categories)}"}
+        else:
+            params = {"limit": 10, "tag": f"tag{self.rng.randint(1, self.args.tags)}"}
+        path = "/blog/all" if "category" not in params and "tag" not in params else "/blog/query"
+        return await self.http.get(path, params=params, headers=self.headers)
+
+    async def get(self):
+        return await self.http.get("/blog/get", params={"id": self.blog_id()}, headers=self.headers)
+
+    async def like(self):
+        blog_id = self.blog_id()
+        if self.rng.random() < 0.5:
+            return await self.http.post(f"/like/{blog_id}/like", headers=self.headers)
+        return await self.http.delete(f"/like/{blog_id}/unlike", headers=self.headers)
+
+    async def comment(self):
+        return await self.http.post(f"/comments/{self.blog_id()}/add-comment", json={"body": "benchmark"}, headers=self.headers)
+
+    async def login(self):
+        return await self.http.post("/auth/login", data={"username": self.username, "password": PASSWORD})
+
+
+async def login(http, username):
+    response = await http.post("/auth/login", data={"username": username, "password": PASSWORD})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in SCENARIOS:
+            raise SystemExit(f"unknown scenario {name!r}, expected one of {', '.join(SCENARIOS)}")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+async def run_load(http, args) -> dict:
+    weights = parse_mix(args.mix)
+    names, cumulative = list(weights), []
+    total = 0.0
+    for name in names:
+        total += weights[name]
+        cumulative.append(total)
+
+    usernames = [f"user{i}" for i in range(1, min(args.concurrency, args.users) + 1)]
+    tokens = [await login(http, username) for username in usernames]
+
+    samples = {name: [] for name in names}      # name -> [(seconds, status)]
+    remaining = args.requests
+
+    async def worker(index):
+        nonlocal remaining
+        rng = random.Random(args.seed * 1000 + index)
+        client = Client(http, usernames[index % len(usernames)], tokens[index % len(tokens)], rng, args)
+        while remaining > 0:
+            remaining -= 1
+            name = rng.choices(names, cum_weights=cumulative)[0]
+            started = time.perf_counter()
+            try:
+                status = (await getattr(client, name)()).status_code
+            except httpx.HTTPError:
+                status = 0
+            samples[name].append((time.perf_counter() - started, status))
+
+    for _ in range(args.warmup):
+        await Client(http, usernames[0], tokens[0], random.Random(args.seed), args).feed()
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker(index) for index in range(args.concurrency)])
+    return summarize(samples, time.perf_counter() - started)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def _stats(values, seconds):
+    latencies = sorted(latency for latency, _ in values)
+    statuses = {}
+    for _, status in values:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {
+        "requests": len(values),
+        "errors": sum(1 for _, status in values if status == 0 or status >= 500),
+        "statuses": statuses,
+        "rps": round(len(values) / seconds, 1) if seconds else None,
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": ms(percentile(latencies, 0.50)),
+        "p95_ms": ms(percentile(latencies, 0.95)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "max_ms": ms(latencies[-1]) if latencies else None,
+    }
+
+
+def summarize(samples, seconds) -> dict:
+    result = {name: _stats(values, seconds) for name, values in samples.items()}
+    result["total"] = _stats([sample for values in samples.values() for sample in values], seconds)
+    result["total"]["seconds"] = round(seconds, 2)
+    return result
+
+
+async def run_in_process(args) -> dict:
+    from main import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as http:
+            return await run_load(http, args)
+
+
+async def run_remote(args, url) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as http:
+        return await run_load(http, args)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_uvicorn(args):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=dict(os.environ),
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url + "/docs", timeout=1)
+            return process, url
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit("uvicorn did not start")
+
+
+# report
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_table(result, baseline=None):
+    print(f"{'scenario':<10} {'requests':>8} {'errors':>6} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, stats in result.items():
+        line = (f"{name:<10} {stats['requests']:>8} {stats['errors']:>6} {stats['rps'] or 0:>8} "
+                f"{stats['p50_ms'] or 0:>8} {stats['p95_ms'] or 0:>8} {stats['p99_ms'] or 0:>8}")
+        before = (baseline or {}).get(name)
+        if before and before.get("p95_ms") and stats["p95_ms"]:
+            line += f"   p95 {stats['p95_ms'] / before['p95_ms']:.2f}x, rps {(stats['rps'] or 0) / (before['rps'] or 1):.2f}x"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="seed a database and benchmark the API")
+    parser.add_argument("--db", help="SQLite file to seed and serve (default: a temporary file)")
+    parser.add_argument("--no-seed", action="store_true", help="use --db as it is")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for data and request order")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--blogs", type=int, default=5000)
+    parser.add_argument("--tags", type=int, default=100)
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--comments", type=int, default=20000)
+    parser.add_argument("--likes", type=int, default=20000)
+    parser.add_argument("--history", type=int, default=20000)
+
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"scenario weights (default {DEFAULT_MIX})")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=20, help="feed requests before measuring")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--uvicorn", action="store_true", help="serve from a local uvicorn process")
+    target.add_argument("--url", help="benchmark an already running server (seeded with the same --db)")
+
+    parser.add_argument("--out", help="write the results as JSON")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    if not args.db:
+        args.db = os.path.join(tempfile.mkdtemp(prefix="blog-benchmark-"), "benchmark.sqlite3")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(args.db)}"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    if not args.no_seed:
+        seed(args)
+
+    if args.url:
+        result = asyncio.run(run_remote(args, args.url))
+    elif args.uvicorn:
+        process, url = start_uvicorn(args)
+        try:
+            result = asyncio.run(run_remote(args, url))
+        finally:
+            process.terminate()
+            process.wait()
+    else:
+        result = asyncio.run(run_in_process(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)["results"]
+    print_table(result, baseline)
+
+    if args.out:
+        report = {
+            "commit": git_commit(),
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "target": args.url or ("uvicorn" if args.uvicorn else "in-process"),
+            "config": {name: value for name, value in vars(args).items() if name not in ("out", "compare")},
+            "results": result,
+        }
+        with open(args.out, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
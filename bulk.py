@@ -0,0 +1,145 @@
+'''
+Bulk blog import and export (POST /blog/bulk, GET /blog/export).
+
+Both speak NDJSON, one blog per line. An import is committed in chunks of
+IMPORT_CHUNK_SIZE lines; the tags and categories of a chunk are resolved
+together (taxonomy.py) and its blogs and blog_tag rows go in as one bulk
+insert each, so a chunk costs a handful of round trips whatever its size.
+
+The export reads from a server-side cursor EXPORT_BATCH_SIZE rows at a time,
+with one extra query per batch for the tags, so memory stays flat however
+many blogs there are.
+'''
+import logging
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import insert, select
+
+from cache import response_cache
+from database import ReadSessionLocal
+import feed
+import models
+from related import related_updater
+from schemas.blog import BlogOut
+import search
+import taxonomy
+import trending
+
+logger = logging.getLogger(__name__)
+
+IMPORT_CHUNK_SIZE = 500
+IMPORT_MAX_ERRORS = 100      # errors reported back, the rest are only counted
+EXPORT_BATCH_SIZE = 1000
+
+
+async def iter_lines(stream):
+    # splits a streamed request body into lines without buffering all of it
+    pending = b""
+    async for data in stream:
+        pending += data
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+def _utc(value: datetime) -> datetime:
+    # naive UTC, as CURRENT_TIMESTAMP stores it
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def import_chunk(db, author_id: int, items) -> int:
+    # items: list of schemas.blog.BlogImport, inserted and committed together
+    if not items:
+        return 0
+
+    tags = [taxonomy.normalize_tags(item.tags) for item in items]
+    category_names = {item.category_name.strip() for item in items if item.category_name and item.category_name.strip()}
+    category_ids = taxonomy.resolve_categories(db, list(category_names)) if category_names else {}
+    tag_ids = taxonomy.resolve_tags(db, list(dict.fromkeys(name for names in tags for name in names)))
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    rows = [
+        {
+            "title": item.title,
+            "body": item.body,
+            "author_id": author_id,
+            "category_id": category_ids.get((item.category_name or "").strip()),
+            "time_created": _utc(item.time_created or now),
+            "time_updated": _utc(item.time_created or now),
+        }
+        for item in items
+    ]
+    blog_ids = db.execute(
+        insert(models.Blog).returning(models.Blog.id, sort_by_parameter_order=True), rows
+    ).scalars().all()
+
+    links = [
+        {"blog_id": blog_id, "tag_id": tag_ids[name]}
+        for blog_id, names in zip(blog_ids, tags)
+        for name in names
+    ]
+    if links:
+        db.execute(models.blog_tag.insert(), links)
+    search.index_blogs(db, blog_ids)
+    feed.index_blogs(db, blog_ids)
+    trending.update(db, blog_ids)
+    db.commit()
+    response_cache.invalidate("blogs")
+    related_updater.mark(*blog_ids)
+    return len(blog_ids)
+
+
+def _tag_names(db, blog_ids) -> dict:
+    names = {}
+    for blog_id, name in db.execute(
+        select(models.blog_tag.c.blog_id, models.Tag.name)
+        .join(models.Tag, models.Tag.id == models.blog_tag.c.tag_id)
+        .where(models.blog_tag.c.blog_id.in_(blog_ids))
+    ):
+        names.setdefault(blog_id, []).append(name)
+    return names
+
+
+def export_lines():
+    # generator of NDJSON lines (bytes); runs on its own session since it
+    # outlives the request handler
+    Blog = models.Blog
+    query = (
+        select(
+            Blog.id, Blog.title, Blog.body, Blog.time_created, Blog.time_updated,
+            Blog.view_count, Blog.likes_count, Blog.comments_count,
+            models.Category.name.label("category_name"),
+        )
+        .outerjoin(models.Category, models.Category.id == Blog.category_id)
+        .order_by(Blog.id)
+        .execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE)
+    )
+
+    started = time.perf_counter()
+    count = 0
+    with ReadSessionLocal() as db:
+        for batch in db.execute(query).partitions():
+            tags = _tag_names(db, [row.id for row in batch])
+            for row in batch:
+                blog = BlogOut(
+                    id=row.id,
+                    title=row.title,
+                    body=row.body,
+                    time_created=row.time_created,
+                    time_updated=row.time_updated,
+                    view_count=row.view_count or 0,
+                    likes_count=row.likes_count or 0,
+                    comments_count=row.comments_count or 0,
+                    category_name=row.category_name,
+                    tags=tags.get(row.id, []),
+                )
+                yield blog.model_dump_json().encode() + b"\n"
+            count += len(batch)
+
+    seconds = time.perf_counter() - started
+    logger.info("exported %d blogs in %.2fs (%.0f rows/s)", count, seconds, count / seconds if seconds else 0)
@@ -0,0 +1,213 @@
+'''
+Response cache for hot read endpoints, and the TTLCache it and the other
+in-process caches (jwt_token.py, taxonomy.py) are built on.
+
+Entries are keyed by path + query string + the current generation of every
+tag the response depends on (e.g. "blogs", "blog:42"). Writers call
+`invalidate(*tags)`, which bumps those generations: later reads compute new
+keys and the stale entries are never looked up again (they age out). This
+works the same for the in-process and the Redis backend and never scans.
+With several workers, in-process generations are bumped in all of them
+through invalidation.channel; Redis ones are shared already.
+
+Responses carry an ETag; a matching If-None-Match gets an empty 304.
+'''
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import Response
+
+from config import RESPONSE_CACHE, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_URL
+from invalidation import channel
+from responses import dump_json
+
+
+class TTLCache:
+    '''
+    Thread-safe LRU cache with a per-entry time to live.
+
+    The least recently used entry is evicted once `maxsize` is reached and
+    expired entries are dropped when they are read.
+    '''
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def discard_where(self, predicate):
+        # predicate(key, value) -> bool
+        with self._lock:
+            stale = [key for key, (_, value) in self._data.items() if predicate(key, value)]
+            for key in stale:
+                del self._data[key]
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class MemoryBackend:
+
+    shared = False
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def set(self, key, value, ttl: float):
+        self._entries.set(key, value, ttl=ttl)
+
+    def generations(self, tags):
+        with self._lock:
+            return [self._generations.get(tag, 0) for tag in tags]
+
+    def bump(self, tags):
+        with self._lock:
+            if len(self._generations) >= self.maxsize:
+                # forgetting a generation would resurrect old entries, so
+                # start over with an empty cache instead
+                self._generations.clear()
+                self._entries.clear()
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+
+
+class RedisBackend:
+
+    shared = True
+
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("RESPONSE_CACHE=redis needs the redis package: pip install redis")
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self._redis.get(f"resp:{key}")
+
+    def set(self, key, value, ttl: float):
+        self._redis.set(f"resp:{key}", value, ex=max(1, int(ttl)))
+
+    def generations(self, tags):
+        values = self._redis.mget([f"gen:{tag}" for tag in tags]) if tags else []
+        return [int(value or 0) for value in values]
+
+    def bump(self, tags):
+        pipe = self._redis.pipeline()
+        for tag in tags:
+            pipe.incr(f"gen:{tag}")
+        pipe.execute()
+
+
+class ResponseCache:
+
+    def __init__(self, backend, ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+
+    def _key(self, request, tags) -> str:
+        query = "&".join(sorted(f"{name}={value}" for name, value in request.query_params.multi_items()))
+        generations = ",".join(str(generation) for generation in self.backend.generations(tags))
+        raw = f"{request.url.path}?{query}#{generations}"
+        return hashlib.blake2b(raw.encode(), digest_size=20).hexdigest()
+
+    def serve(self, request, response, tags, response_model, build):
+        '''
+        Return the cached response for this request, or call `build()`,
+        serialize its result with `response_model` and cache it. Headers the
+        handler sets on `response` (e.g. X-Next-Cursor) are cached too.
+        '''
+        if self.backend is None:
+            body = dump_json(response_model, build())
+            headers = _handler_headers(response)
+        else:
+            key = self._key(request, tags)
+            cached = self.backend.get(key)
+            if cached is not None:
+                headers, body = cached.split(b"\n", 1)
+                headers = json.loads(headers)
+            else:
+                body = dump_json(response_model, build())
+                headers = _handler_headers(response)
+                self.backend.set(key, json.dumps(headers).encode() + b"\n" + body, self.ttl)
+
+        etag = '"{}"'.format(hashlib.blake2b(body, digest_size=16).hexdigest())
+        headers = dict(headers, etag=etag)
+        if etag in _etags(request.headers.get("if-none-match")):
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type="application/json", headers=headers)
+
+    def invalidate(self, *tags):
+        if self.backend is not None and tags:
+            self.backend.bump(tags)
+            if not self.backend.shared:
+                channel.publish("response-cache", *tags)
+
+
+def _handler_headers(response) -> dict:
+    # what the handler set on its `response` parameter, minus the length
+    # of its (empty) body
+    return {name: value for name, value in response.headers.items() if name != "content-length"}
+
+
+def _etags(header):
+    if not header:
+        return set()
+    return {tag.strip().removeprefix("W/") for tag in header.split(",")}
+
+
+def make_response_cache() -> ResponseCache:
+    if RESPONSE_CACHE == "redis":
+        backend = RedisBackend(RESPONSE_CACHE_URL)
+    elif RESPONSE_CACHE == "memory":
+        backend = MemoryBackend(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+    else:
+        backend = None
+    return ResponseCache(backend, RESPONSE_CACHE_TTL)
+
+
+response_cache = make_response_cache()
+if response_cache.backend is not None and not response_cache.backend.shared:
+    channel.subscribe("response-cache", lambda *tags: response_cache.backend.bump(tags))
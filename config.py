@@ -0,0 +1,114 @@
+import os
+
+
+def env_bool(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# database
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./blogdb.sqlite3")
+# defaults to DATABASE_URL with the matching async driver (aiosqlite, asyncpg, ...)
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
+
+# serve the blog/user/comment/like/tag/category routers from async endpoints
+# running on an AsyncSession instead of the sync threadpool path
+ASYNC_DB = env_bool("ASYNC_DB")
+
+# separate engine for GET endpoints; a replica URL, otherwise a read-only
+# connection to the same SQLite file (or the primary for other backends)
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL")
+
+# connection pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))     # seconds
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))       # seconds
+
+# sqlite pragmas applied to every new connection
+SQLITE_WAL = env_bool("SQLITE_WAL", True)
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))   # bytes
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))               # negative = KiB
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))             # ms
+
+# verified tokens and their user, cached by get_current_user
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", "300"))       # seconds
+
+# password hashing, run on its own pool so login storms don't starve the
+# request threadpool
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", "64"))    # queued + running, then 503
+
+# GET /blog/get buffers view counts and history touches, flushed in bulk
+VIEW_FLUSH_INTERVAL = float(os.getenv("VIEW_FLUSH_INTERVAL", "5"))     # seconds
+VIEW_FLUSH_SIZE = int(os.getenv("VIEW_FLUSH_SIZE", "1000"))            # pending history rows
+
+# response cache for hot read endpoints: "memory", "redis" or "off"
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "memory")
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL", "redis://localhost:6379/0")
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "30"))        # seconds
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "4096"))    # entries (memory)
+
+# likes/comments/favourite counters are recomputed from their tables in the
+# background every N seconds (0 disables it)
+COUNTER_RECONCILE_INTERVAL = float(os.getenv("COUNTER_RECONCILE_INTERVAL", "3600"))
+COUNTER_RECONCILE_BATCH = int(os.getenv("COUNTER_RECONCILE_BATCH", "5000"))     # blogs per transaction
+
+# tag/category name -> id cache used when writing blogs
+TAXONOMY_CACHE_SIZE = int(os.getenv("TAXONOMY_CACHE_SIZE", "50000"))
+TAXONOMY_CACHE_TTL = int(os.getenv("TAXONOMY_CACHE_TTL", "3600"))      # seconds
+
+# request metrics: Server-Timing headers and Prometheus text on /metrics
+METRICS = env_bool("METRICS", True)
+# requests slower than this (ms) get a sampled profile written to PROFILE_DIR
+# as collapsed stacks (flamegraph.pl / speedscope); 0 disables profiling
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+# apply pending schema migrations at startup (migrations.py); with 0 the app
+# only checks the schema version and `python migrations.py upgrade` is run
+# once per deploy
+AUTO_MIGRATE = env_bool("AUTO_MIGRATE", True)
+
+# trending feed: scores of blogs whose counters changed are recomputed every
+# N seconds (0 disables the job); every TRENDING_DECAY seconds of age weigh
+# as much as 10x the engagement
+TRENDING_INTERVAL = float(os.getenv("TRENDING_INTERVAL", "60"))
+TRENDING_DECAY = float(os.getenv("TRENDING_DECAY", "45000"))
+
+# related blogs (related.py): neighbours kept per blog, seconds between
+# incremental updates of the blogs that got new tags/likes/favourites/views
+# (0 disables the job), and how many blogs a tag or user may share before it
+# is too common to count as a signal
+RELATED_TOP_K = int(os.getenv("RELATED_TOP_K", "20"))
+RELATED_INTERVAL = float(os.getenv("RELATED_INTERVAL", "300"))
+RELATED_MAX_DF = int(os.getenv("RELATED_MAX_DF", "500"))
+
+# reading history (history.py): rows older than HISTORY_RETENTION_DAYS and
+# beyond each user's HISTORY_MAX_PER_USER latest are pruned every
+# HISTORY_PRUNE_INTERVAL seconds (0 disables each of them)
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "365"))
+HISTORY_MAX_PER_USER = int(os.getenv("HISTORY_MAX_PER_USER", "1000"))
+HISTORY_PRUNE_INTERVAL = float(os.getenv("HISTORY_PRUNE_INTERVAL", "3600"))
+HISTORY_PRUNE_BATCH = int(os.getenv("HISTORY_PRUNE_BATCH", "1000"))      # users per transaction
+
+# background job runner (jobs.py): worker tasks, retries of a failing job,
+# batching of deferred writes, and how long shutdown waits for queued jobs
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_RETRIES = int(os.getenv("JOB_RETRIES", "3"))
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", "500"))
+JOB_BATCH_WAIT = float(os.getenv("JOB_BATCH_WAIT", "0.5"))      # seconds
+JOB_DRAIN_TIMEOUT = float(os.getenv("JOB_DRAIN_TIMEOUT", "30"))   # seconds
+
+# multi-process deployments (serve.py): a directory shared by the workers of
+# one deployment (empty = single process), and how in-process caches are
+# kept coherent across them (invalidation.py): off, socket or redis
+WORKER_DIR = os.getenv("WORKER_DIR", "")
+INVALIDATION = os.getenv("INVALIDATION", "socket" if WORKER_DIR else "off")
+INVALIDATION_URL = os.getenv("INVALIDATION_URL", "redis://localhost:6379/0")
@@ -0,0 +1,99 @@
+'''
+Denormalized blog counters: likes_count, comments_count, favourite_count.
+
+Handlers change them with one atomic `UPDATE blogs SET x = x + :n` inside
+their own transaction, so concurrent requests can't lose updates. Counters
+no response depends on are bumped with `bump_later` instead: the deltas are
+batched on the job runner (jobs.py) and applied as one bulk UPDATE. Drift
+(e.g. rows removed by cascades) is repaired by `reconcile`, which recomputes
+every counter from the source tables in bulk, one id range per transaction.
+main.py runs it every COUNTER_RECONCILE_INTERVAL seconds on the job runner.
+'''
+import logging
+from collections import Counter
+
+from sqlalchemy import bindparam, func, or_, select, update
+
+from cache import response_cache
+from config import COUNTER_RECONCILE_BATCH
+from database import SessionLocal
+from jobs import runner
+import models
+from trending import trending_updater
+
+logger = logging.getLogger(__name__)
+
+blogs = models.Blog.__table__
+
+
+def bump(db, blog_id: int, **deltas):
+    # bump(db, 1, likes_count=1) -> UPDATE blogs SET likes_count = likes_count + 1 WHERE id = 1
+    # returns the new values as a row, or None if there is no such blog
+    trending_updater.mark(blog_id)
+    return db.execute(
+        update(blogs)
+        .where(blogs.c.id == blog_id)
+        .values({name: func.coalesce(blogs.c[name], 0) + delta for name, delta in deltas.items()})
+        .returning(*[blogs.c[name] for name in deltas])
+    ).first()
+
+
+def bump_later(blog_id: int, **deltas):
+    # like bump, after the handler's transaction and batched with others
+    runner.submit_batch("counter-bumps", apply_bumps, (blog_id, deltas))
+
+
+def apply_bumps(items):
+    # items: [(blog_id, {column: delta}), ...] -> one UPDATE per column
+    totals = {}
+    for blog_id, deltas in items:
+        for name, delta in deltas.items():
+            totals.setdefault(name, Counter())[blog_id] += delta
+    with SessionLocal() as db:
+        for name, by_blog in totals.items():
+            rows = [{"b_id": blog_id, "n": n} for blog_id, n in by_blog.items() if n]
+            if rows:
+                db.execute(
+                    update(blogs)
+                    .where(blogs.c.id == bindparam("b_id"))
+                    .values({name: func.coalesce(blogs.c[name], 0) + bindparam("n")}),
+                    rows,
+                )
+        db.commit()
+    blog_ids = {blog_id for blog_id, _ in items}
+    trending_updater.mark(*blog_ids)
+    response_cache.invalidate("blogs", *[f"blog:{blog_id}" for blog_id in blog_ids])
+
+
+def _actual_counts():
+    likes = models.Like.__table__
+    comments = models.Comment.__table__
+    favourites = models.favourite_blog_table
+    return {
+        "likes_count": select(func.count()).where(likes.c.blog_id == blogs.c.id).scalar_subquery(),
+        "comments_count": select(func.count()).where(comments.c.blog_id == blogs.c.id).scalar_subquery(),
+        "favourite_count": select(func.count()).where(favourites.c.blog_id == blogs.c.id).scalar_subquery(),
+    }
+
+
+def reconcile(batch_size: int = COUNTER_RECONCILE_BATCH) -> int:
+    # -> number of blogs whose counters were wrong
+    fixed = 0
+    actual = _actual_counts()
+    drifted = or_(*[func.coalesce(blogs.c[name], -1) != count for name, count in actual.items()])
+
+    with SessionLocal() as db:
+        last_id = db.execute(select(func.max(blogs.c.id))).scalar() or 0
+        for start in range(0, last_id, batch_size):
+            result = db.execute(
+                update(blogs)
+                .where(blogs.c.id > start, blogs.c.id <= start + batch_size, drifted)
+                .values(actual)
+            )
+            db.commit()
+            fixed += result.rowcount
+
+    if fixed:
+        logger.info("counter reconciliation fixed %d blogs", fixed)
+        response_cache.invalidate("blogs")
+    return fixed
@@ -1,13 +1,82 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./blogdb.sqlite3"
+import config
+from config import ASYNC_DATABASE_URL, ASYNC_DB, READ_DATABASE_URL, SQLALCHEMY_DATABASE_URL
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+
+def is_sqlite_file(url) -> bool:
+    url = make_url(url)
+    return url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:")
+
+
+def read_only_url(url):
+    # sqlite:///file:path?mode=ro&uri=true -> readers never take the write lock
+    url = make_url(url)
+    return url.set(database=f"file:{url.database}").update_query_dict({"mode": "ro", "uri": "true"})
+
+
+def set_sqlite_pragmas(dbapi_connection, read_only: bool):
+    cursor = dbapi_connection.cursor()
+    if config.SQLITE_WAL and not read_only:
+        cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA mmap_size={config.SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size={config.SQLITE_CACHE_SIZE}")
+    cursor.execute(f"PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT}")
+    cursor.close()
+
+
+def engine_options(url) -> dict:
+    url = make_url(url)
+    options = {}
+    if url.get_backend_name() == "sqlite":
+        options["connect_args"] = {"check_same_thread": False}
+        if not is_sqlite_file(url):
+            return options          # in-memory databases use a singleton pool
+    options.update(
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW,
+        pool_recycle=config.DB_POOL_RECYCLE,
+        pool_timeout=config.DB_POOL_TIMEOUT,
+        pool_pre_ping=True,
+    )
+    return options
+
+
+def listen_for_pragmas(engine, read_only: bool):
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        set_sqlite_pragmas(dbapi_connection, read_only)
+
+
+def make_engine(url, read_only: bool = False):
+    if read_only and is_sqlite_file(url):
+        url = read_only_url(url)
+    engine = create_engine(url, **engine_options(url))
+    listen_for_pragmas(engine, read_only)
+    return engine
+
+
+def make_read_engine(url, replica_url=None, primary=None):
+    if replica_url:
+        return make_engine(replica_url, read_only=True)
+    if is_sqlite_file(url):
+        return make_engine(url, read_only=True)
+    return primary
+
+
+engine = make_engine(SQLALCHEMY_DATABASE_URL)
+read_engine = make_read_engine(SQLALCHEMY_DATABASE_URL, READ_DATABASE_URL, primary=engine)
 
 
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+ReadSessionLocal = sessionmaker(bind=read_engine, autocommit=False, autoflush=False)
 
 Base = declarative_base()
 
@@ -17,4 +86,86 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def get_read_db():
+    db = ReadSessionLocal()
+
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def dialect_insert(db):
+    # db: a Session or a Connection
+    dialect = db.dialect if hasattr(db, "dialect") else db.bind.dialect
+    if dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+# insert ... on conflict do update, for sqlite and postgresql
+def upsert(db, table, rows, index_elements, update_columns):
+    insert = dialect_insert(db)
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={column: stmt.excluded[column] for column in update_columns},
+    )
+    db.execute(stmt, rows)
+
+
+# insert ... on conflict do nothing -> number of rows inserted
+def insert_ignore(db, table, values) -> int:
+    return db.execute(dialect_insert(db)(table).values(values).on_conflict_do_nothing()).rowcount
+
+
+# async path (ASYNC_DB=1), needs the async driver for the backend installed
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg", "mysql": "aiomysql"}
+
+def to_async_url(url: str) -> str:
+    url = make_url(url)
+    return url.set(drivername=f"{url.get_backend_name()}+{ASYNC_DRIVERS[url.get_backend_name()]}").render_as_string(hide_password=False)
+
+
+def make_async_engine(url, read_only: bool = False):
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    if read_only and is_sqlite_file(url):
+        url = read_only_url(url)
+    options = engine_options(url)
+    options.pop("connect_args", None)
+    async_engine = create_async_engine(url, **options)
+    listen_for_pragmas(async_engine.sync_engine, read_only)
+    return async_engine
+
+
+async_engine = None
+async_read_engine = None
+AsyncSessionLocal = None
+AsyncReadSessionLocal = None
+
+if ASYNC_DB:
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+    ASYNC_URL = ASYNC_DATABASE_URL or to_async_url(SQLALCHEMY_DATABASE_URL)
+    async_engine = make_async_engine(ASYNC_URL)
+    if READ_DATABASE_URL:
+        async_read_engine = make_async_engine(to_async_url(READ_DATABASE_URL), read_only=True)
+    elif is_sqlite_file(ASYNC_URL):
+        async_read_engine = make_async_engine(ASYNC_URL, read_only=True)
+    else:
+        async_read_engine = async_engine
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False)
+    AsyncReadSessionLocal = async_sessionmaker(bind=async_read_engine, autoflush=False)
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_async_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
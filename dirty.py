@@ -0,0 +1,46 @@
+'''
+Background recomputation of read models for the blogs writers touched.
+
+Writers `mark(*blog_ids)` (a set insert, no I/O); `run_once` takes the
+marked ids and calls `update(db, blog_ids)` with them in one transaction.
+main.py runs it every `interval` seconds on the job runner (jobs.py), and
+once more on shutdown so nothing marked is lost. Ids whose update failed
+are marked again before the error propagates, so the runner's retry (or
+the next run) picks them up. `after_commit()`, if given, runs after each
+update that changed something, e.g. to invalidate cached pages.
+'''
+import threading
+
+from database import SessionLocal
+
+
+class DirtyUpdater:
+
+    def __init__(self, name: str, update, interval: float, after_commit=None):
+        self.name = name
+        self.update = update
+        self.interval = interval
+        self.after_commit = after_commit
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def mark(self, *blog_ids):
+        with self._lock:
+            self._dirty.update(blog_ids)
+
+    def run_once(self) -> int:
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return 0
+        try:
+            with SessionLocal() as db:
+                updated = self.update(db, dirty)
+                db.commit()
+        except Exception:
+            with self._lock:
+                self._dirty.update(dirty)
+            raise
+        if updated and self.after_commit is not None:
+            self.after_commit()
+        return updated
@@ -0,0 +1,104 @@
+'''
+Category/tag feeds for /blog/query (the blog_feed read model).
+
+Every blog has a row in blog_feed for each (category_id, tag_id) filter it
+matches, 0 meaning "any": (0, 0), (its category, 0), (0, each tag) and (its
+category, each tag). The primary key starts with (category_id, tag_id,
+time_created), so a filtered page is one index range scan of `limit` rows
+whatever the number of blogs, tags or categories.
+
+The blog, tag and category routers keep it in sync inside their own
+transactions; `python feed.py rebuild` rebuilds it from scratch.
+'''
+from sqlalchemy import delete, func, literal, select, union_all
+
+from pagination import paginate
+import models
+
+feed = models.blog_feed
+
+
+def _feed_rows(blog_ids=None):
+    # SELECT of the feed rows of the given blogs (all blogs when None)
+    blogs = models.Blog.__table__
+    links = models.blog_tag
+    tagged = blogs.join(links, links.c.blog_id == blogs.c.id)
+    has_category = blogs.c.category_id.isnot(None)
+
+    selects = [
+        select(literal(0), literal(0), blogs.c.time_created, blogs.c.id),
+        select(blogs.c.category_id, literal(0), blogs.c.time_created, blogs.c.id).where(has_category),
+        select(literal(0), links.c.tag_id, blogs.c.time_created, blogs.c.id).select_from(tagged),
+        select(blogs.c.category_id, links.c.tag_id, blogs.c.time_created, blogs.c.id).select_from(tagged).where(has_category),
+    ]
+    if blog_ids is not None:
+        selects = [query.where(blogs.c.id.in_(blog_ids)) for query in selects]
+    return union_all(*selects)
+
+
+def _insert(db, blog_ids=None):
+    columns = ["category_id", "tag_id", "time_created", "blog_id"]
+    db.execute(feed.insert().from_select(columns, _feed_rows(blog_ids)))
+
+
+def index_blogs(db, blog_ids):
+    # (re)build the rows of the given blogs, in the caller's transaction
+    if not blog_ids:
+        return
+    blog_ids = list(blog_ids)
+    remove_blogs(db, blog_ids)
+    _insert(db, blog_ids)
+
+
+def remove_blogs(db, blog_ids):
+    if not blog_ids:
+        return
+    db.execute(delete(feed).where(feed.c.blog_id.in_(list(blog_ids))))
+
+
+def remove_tag(db, tag_id: int):
+    db.execute(delete(feed).where(feed.c.tag_id == tag_id))
+
+
+def remove_category(db, category_id: int):
+    db.execute(delete(feed).where(feed.c.category_id == category_id))
+
+
+def rebuild(db):
+    db.execute(delete(feed))
+    _insert(db)
+
+
+def ensure_index(connection) -> bool:
+    # fills the table from existing blogs when it is empty (migrations.py)
+    if connection.execute(select(feed.c.blog_id).limit(1)).first():
+        return False
+    if not connection.execute(select(models.Blog.id).limit(1)).first():
+        return False
+    _insert(connection)
+    return True
+
+
+def page(db, category_id: int, tag_id: int, cursor: str = None, limit: int = 10):
+    # -> (blog ids newest first, next_cursor); the cursor is the same
+    # (time_created, id) pair as the other blog listings
+    query = db.query(feed.c.time_created, feed.c.blog_id).filter(
+        feed.c.category_id == category_id, feed.c.tag_id == tag_id,
+    )
+    rows, next_cursor = paginate(query, [feed.c.time_created, feed.c.blog_id], cursor, limit)
+    return [row.blog_id for row in rows], next_cursor
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="blog_feed read model")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.parse_args()
+
+    with SessionLocal() as db:
+        rebuild(db)
+        db.commit()
+        print(f"{feed.name} rebuilt: {db.execute(select(func.count()).select_from(feed)).scalar()} rows")
@@ -0,0 +1,83 @@
+'''
+Reading history retention.
+
+history holds the latest view of each (user, blog): views.ViewBuffer
+compacts the view events of a flush interval in memory and upserts them,
+so repeated reads only move viewed_at. To keep the table bounded, `prune`
+deletes rows older than HISTORY_RETENTION_DAYS and, per user, all but the
+HISTORY_MAX_PER_USER latest, one user id range per transaction, through
+the (user_id, viewed_at) index. main.py runs it every
+HISTORY_PRUNE_INTERVAL seconds on the job runner (jobs.py), or run it once
+with:
+
+    python history.py prune
+'''
+import logging
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, func, select, tuple_
+
+from config import HISTORY_MAX_PER_USER, HISTORY_PRUNE_BATCH, HISTORY_RETENTION_DAYS
+from database import SessionLocal
+import models
+
+logger = logging.getLogger(__name__)
+
+history = models.History.__table__
+users = models.User.__table__
+
+
+def _over_cap(users_in_range, cap: int):
+    # (user_id, blog_id) of the rows past each user's `cap` latest views
+    ranked = select(
+        history.c.user_id,
+        history.c.blog_id,
+        func.row_number().over(
+            partition_by=history.c.user_id,
+            order_by=(history.c.viewed_at.desc(), history.c.blog_id.desc()),
+        ).label("position"),
+    ).where(users_in_range).subquery()
+    return select(ranked.c.user_id, ranked.c.blog_id).where(ranked.c.position > cap)
+
+
+def prune(retention_days: int = HISTORY_RETENTION_DAYS, max_per_user: int = HISTORY_MAX_PER_USER,
+          batch_size: int = HISTORY_PRUNE_BATCH) -> int:
+    # -> number of history rows deleted
+    if retention_days <= 0 and max_per_user <= 0:
+        return 0
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=retention_days)
+    deleted = 0
+
+    with SessionLocal() as db:
+        last_id = db.execute(select(func.max(users.c.id))).scalar() or 0
+        for start in range(0, last_id, batch_size):
+            users_in_range = (history.c.user_id > start) & (history.c.user_id <= start + batch_size)
+            if retention_days > 0:
+                deleted += db.execute(
+                    delete(history).where(users_in_range, history.c.viewed_at < cutoff)
+                ).rowcount
+            if max_per_user > 0:
+                deleted += db.execute(
+                    delete(history).where(
+                        tuple_(history.c.user_id, history.c.blog_id).in_(_over_cap(users_in_range, max_per_user))
+                    )
+                ).rowcount
+            db.commit()
+    if deleted:
+        logger.info("history pruning deleted %d rows", deleted)
+    return deleted
+
+
+def clear_history(db, user_id: int) -> int:
+    # the user's whole history, in one statement
+    return db.execute(delete(history).where(history.c.user_id == user_id)).rowcount
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="reading history retention")
+    parser.add_argument("command", choices=["prune"])
+    parser.parse_args()
+
+    print(f"{prune()} history rows deleted")
@@ -0,0 +1,234 @@
+'''
+Cross-worker invalidation of in-process caches.
+
+Every worker process has its own auth_cache (jwt_token.py), tag and
+category id caches (taxonomy.py) and, with RESPONSE_CACHE=memory, response
+cache generations (cache.py). The module owning a cache applies a change
+locally and `channel.publish(kind, *args)`es it; the other workers apply it
+with the handler the module registered with `channel.subscribe(kind, fn)`.
+`publish` only puts the event on an in-memory outbox and returns; a sender
+thread delivers it, so a slow or hung worker never holds up a request.
+
+INVALIDATION picks the transport:
+
+    off     a single process (the default without WORKER_DIR): no-op
+    socket  workers on one host: each binds a Unix datagram socket in
+            WORKER_DIR and sends every event to the others (serve.py).
+            The sender waits while a receiver's queue is full, for up to
+            SEND_TIMEOUT seconds, so bursts are not dropped
+    redis   Redis pub/sub (or a server speaking it) at INVALIDATION_URL,
+            for workers on several hosts; needs `pip install redis`
+
+Delivery is asynchronous: another worker may serve a stale entry for the
+moment an event takes to arrive. An event is lost only when a worker stops
+reading its socket, Redis is unreachable or OUTBOX_SIZE events are waiting
+to be sent, and the caches' TTLs bound what that costs.
+'''
+import json
+import logging
+import os
+import queue
+import socket
+import struct
+import threading
+import uuid
+
+from config import INVALIDATION, INVALIDATION_URL, WORKER_DIR
+
+logger = logging.getLogger(__name__)
+
+REDIS_CHANNEL = "blog-api:invalidate"
+SEND_TIMEOUT = 1.0      # seconds a send waits for room in a worker's socket queue
+OUTBOX_SIZE = 10000     # events waiting for the sender thread, then new ones are dropped
+
+
+class Channel:
+    # INVALIDATION=off; the transports below override publish/start/stop
+
+    def __init__(self):
+        self.origin = None
+        self._handlers = {}     # kind -> [handler]
+
+    def subscribe(self, kind: str, handler):
+        self._handlers.setdefault(kind, []).append(handler)
+
+    def publish(self, kind: str, *args):
+        pass
+
+    def start(self):
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    def stop(self):
+        pass
+
+    def _encode(self, kind: str, args) -> bytes:
+        return json.dumps({"origin": self.origin, "kind": kind, "args": list(args)}).encode()
+
+    def _receive(self, data: bytes):
+        try:
+            message = json.loads(data)
+        except ValueError:
+            logger.warning("ignoring malformed invalidation event %r", data[:100])
+            return
+        if message.get("origin") == self.origin:
+            return
+        for handler in self._handlers.get(message.get("kind"), ()):
+            try:
+                handler(*message["args"])
+            except Exception:
+                logger.exception("invalidation handler for %s failed", message.get("kind"))
+
+
+class QueuedChannel(Channel):
+    # publish() enqueues; a sender thread hands the events to `_send`
+
+    def __init__(self):
+        super().__init__()
+        self._outbox = None
+        self._sender_thread = None
+
+    def start(self):
+        super().start()
+        self._outbox = queue.Queue(maxsize=OUTBOX_SIZE)
+        self._sender_thread = threading.Thread(target=self._drain, name="invalidation-sender", daemon=True)
+        self._sender_thread.start()
+
+    def publish(self, kind: str, *args):
+        if self._outbox is None:
+            return
+        try:
+            self._outbox.put_nowait(self._encode(kind, args))
+        except queue.Full:
+            logger.warning("invalidation event %s dropped, %d events are waiting to be sent", kind, OUTBOX_SIZE)
+
+    def _drain(self):
+        while True:
+            data = self._outbox.get()
+            if data is None:        # stop(), after the events queued before it
+                return
+            try:
+                self._send(data)
+            except Exception:
+                logger.exception("sending an invalidation event failed")
+
+    def _send(self, data: bytes):
+        raise NotImplementedError
+
+    def stop(self):
+        if self._outbox is None:
+            return
+        self._outbox.put(None)
+        self._sender_thread.join()
+        self._outbox = self._sender_thread = None
+
+
+class SocketChannel(QueuedChannel):
+
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = directory
+        self.path = None
+        self._socket = None
+        self._sender = None
+        self._thread = None
+
+    def start(self):
+        super().start()
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, f"worker-{self.origin}.sock")
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(self.path)
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        # the default queue of a datagram socket is ~10 messages
+        # (net.unix.max_dgram_qlen): the sender thread waits for the
+        # receiver to catch up instead of dropping, but not forever on a
+        # hung worker
+        seconds, fraction = divmod(SEND_TIMEOUT, 1)
+        self._sender.setsockopt(
+            socket.SOL_SOCKET, socket.SO_SNDTIMEO, struct.pack("ll", int(seconds), int(fraction * 1e6))
+        )
+        self._thread = threading.Thread(target=self._listen, name="invalidation-listener", daemon=True)
+        self._thread.start()
+
+    def _listen(self):
+        while True:
+            try:
+                data = self._socket.recv(65536)
+            except OSError:
+                return
+            if not data:        # stop()
+                return
+            self._receive(data)
+
+    def _send(self, data: bytes):
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith(".sock") or path == self.path:
+                continue
+            try:
+                self._sender.sendto(data, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # nobody listens there anymore: a worker that died
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            except BlockingIOError:
+                logger.warning("invalidation event to %s dropped, its queue stayed full for %ss", name, SEND_TIMEOUT)
+
+    def stop(self):
+        if self._socket is None:
+            return
+        super().stop()
+        self._sender.sendto(b"", self.path)
+        self._thread.join()
+        for sock in (self._socket, self._sender):
+            sock.close()
+        self._socket = self._sender = self._thread = None
+        os.unlink(self.path)
+
+
+class RedisChannel(QueuedChannel):
+
+    def __init__(self, url: str):
+        super().__init__()
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("INVALIDATION=redis needs the redis package: pip install redis")
+        self._redis = redis.Redis.from_url(url)
+        self._pubsub = None
+        self._thread = None
+
+    def start(self):
+        super().start()
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(**{REDIS_CHANNEL: lambda message: self._receive(message["data"])})
+        self._thread = self._pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def _send(self, data: bytes):
+        self._redis.publish(REDIS_CHANNEL, data)
+
+    def stop(self):
+        if self._pubsub is None:
+            return
+        super().stop()
+        self._thread.stop()
+        self._thread.join()
+        self._pubsub.close()
+        self._pubsub = self._thread = None
+
+
+def make_channel() -> Channel:
+    if INVALIDATION == "socket":
+        if not WORKER_DIR:
+            raise RuntimeError("INVALIDATION=socket needs WORKER_DIR (serve.py sets it)")
+        return SocketChannel(WORKER_DIR)
+    if INVALIDATION == "redis":
+        return RedisChannel(INVALIDATION_URL)
+    return Channel()
+
+
+channel = make_channel()
@@ -0,0 +1,223 @@
+'''
+In-process background jobs.
+
+Handlers hand work that the response doesn't depend on to `runner` and
+return right away:
+
+    runner.submit("name", fn, *args)        # one call of fn(*args)
+    runner.submit_batch("name", fn, item)   # fn(items) once per batch
+
+Batches are flushed after JOB_BATCH_WAIT seconds or JOB_BATCH_SIZE items,
+whichever comes first. Maintenance tasks are registered once with
+`runner.every(name, interval, fn)`; `final=True` runs them once more on
+shutdown (e.g. flushing buffered views), and `singleton=True` tasks, which
+work on the whole database, run in only one worker of a multi-process
+deployment (whichever holds the lock file in WORKER_DIR). All of these are
+safe to call from the handler threads.
+
+main.lifespan starts the runner on the event loop: JOB_WORKERS asyncio
+tasks take jobs off an asyncio.Queue and run them in the threadpool (the
+work is sync SQLAlchemy code). A job that raises is retried JOB_RETRIES
+times with exponential backoff, then logged and dropped. On shutdown the
+periodic tasks stop, open batches are flushed and the queue is drained for
+up to JOB_DRAIN_TIMEOUT seconds before the final runs. Without a running
+runner (CLIs, scripts) jobs run inline.
+
+Queue depth, time spent queued, run times, retries and failures are on
+/metrics.
+'''
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from fastapi.concurrency import run_in_threadpool
+
+from config import JOB_BATCH_SIZE, JOB_BATCH_WAIT, JOB_DRAIN_TIMEOUT, JOB_RETRIES, JOB_WORKERS, WORKER_DIR
+import metrics
+
+try:
+    import fcntl
+except ImportError:     # not on Windows: every worker runs singleton tasks
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+RETRY_BACKOFF = 0.5     # seconds before the first retry, doubled each time
+
+
+class Job:
+
+    __slots__ = ("name", "fn", "args", "attempts", "queued_at")
+
+    def __init__(self, name: str, fn, args):
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.attempts = 0
+        self.queued_at = time.perf_counter()
+
+
+class JobRunner:
+
+    def __init__(self, workers: int = JOB_WORKERS, retries: int = JOB_RETRIES, batch_size: int = JOB_BATCH_SIZE,
+                 batch_wait: float = JOB_BATCH_WAIT, drain_timeout: float = JOB_DRAIN_TIMEOUT):
+        self.workers = workers
+        self.retries = retries
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.drain_timeout = drain_timeout
+        self._lock = threading.Lock()
+        self._batches = {}          # name -> (fn, items)
+        self._periodic = []         # (name, interval, fn, final, singleton)
+        self._leader_lock = None
+        self._loop = None
+        self._queue = None
+        self._stopping = None
+        self._tasks = []
+        self._periodic_tasks = []
+        metrics.registry.job_queue_depth = self.depth
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    # -- enqueueing, from any thread
+
+    def submit(self, name: str, fn, *args):
+        job = Job(name, fn, args)
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._queue.put_nowait, job)
+                return
+            except RuntimeError:    # the loop closed meanwhile
+                pass
+        self._run_inline(job)
+
+    def submit_batch(self, name: str, fn, item):
+        with self._lock:
+            _, items = self._batches.setdefault(name, (fn, []))
+            items.append(item)
+            first, full = len(items) == 1, len(items) >= self.batch_size
+        loop = self._loop
+        if full or loop is None:
+            self._flush_batch(name)
+        elif first:
+            try:
+                loop.call_soon_threadsafe(loop.call_later, self.batch_wait, self._flush_batch, name)
+            except RuntimeError:
+                self._flush_batch(name)
+
+    def every(self, name: str, interval: float, fn, final: bool = False, singleton: bool = False):
+        # register a maintenance task; interval <= 0 disables it
+        if interval > 0:
+            self._periodic.append((name, interval, fn, final, singleton))
+
+    def _is_leader(self) -> bool:
+        # checked before every run, so another worker takes over when the
+        # leader exits
+        if not WORKER_DIR or fcntl is None or self._leader_lock is not None:
+            return True
+        lock = open(os.path.join(WORKER_DIR, "maintenance.lock"), "a")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            return False
+        self._leader_lock = lock
+        return True
+
+    def _flush_batch(self, name: str):
+        with self._lock:
+            fn, items = self._batches.pop(name, (None, None))
+        if items:
+            self.submit(name, fn, items)
+
+    # -- running
+
+    def _run_inline(self, job: Job):
+        try:
+            job.fn(*job.args)
+        except Exception:
+            logger.exception("job %s failed", job.name)
+            metrics.registry.observe_job(job.name, 0.0, failed=True)
+
+    async def _execute(self, job: Job):
+        while True:
+            started = time.perf_counter()
+            try:
+                await run_in_threadpool(job.fn, *job.args)
+            except Exception:
+                job.attempts += 1
+                if job.attempts > self.retries:
+                    logger.exception("job %s failed after %d attempts", job.name, job.attempts)
+                    metrics.registry.observe_job(job.name, time.perf_counter() - started, failed=True)
+                    return
+                logger.warning("job %s failed, retrying (attempt %d)", job.name, job.attempts, exc_info=True)
+                metrics.registry.observe_job(job.name, time.perf_counter() - started, retried=True)
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** (job.attempts - 1))
+                continue
+            metrics.registry.observe_job(job.name, time.perf_counter() - started)
+            return
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                metrics.registry.observe_job_wait(time.perf_counter() - job.queued_at)
+                await self._execute(job)
+            finally:
+                self._queue.task_done()
+
+    async def _every(self, name: str, interval: float, fn, singleton: bool):
+        while True:
+            try:
+                await asyncio.wait_for(self._stopping.wait(), interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            if not singleton or self._is_leader():
+                await self._execute(Job(name, fn, ()))
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._stopping = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._periodic_tasks = [
+            asyncio.create_task(self._every(name, interval, fn, singleton))
+            for name, interval, fn, _, singleton in self._periodic
+        ]
+        self._loop = asyncio.get_running_loop()
+
+    async def _drain(self):
+        for name in list(self._batches):
+            self._flush_batch(name)
+        await asyncio.sleep(0)      # let in the jobs submitted with call_soon_threadsafe
+        try:
+            await asyncio.wait_for(self._queue.join(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("%d background jobs dropped at shutdown", self._queue.qsize())
+
+    async def stop(self):
+        if self._loop is None:
+            return
+        # periodic runs in progress finish, then the queue is drained
+        self._stopping.set()
+        await asyncio.gather(*self._periodic_tasks)
+        await self._drain()
+        for name, _, fn, final, _ in self._periodic:
+            if final:
+                await self._execute(Job(name, fn, ()))
+        await self._drain()
+        self._loop = None
+        if self._leader_lock is not None:
+            self._leader_lock.close()
+            self._leader_lock = None
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+runner = JobRunner()
@@ -1,11 +1,16 @@
+import time
 from datetime import datetime, timedelta, timezone
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
-from database import get_db
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, make_transient_to_detached, object_session
+from cache import TTLCache
+from config import AUTH_CACHE_SIZE, AUTH_CACHE_TTL
+from database import get_async_db, get_db
+from invalidation import channel
 from models import User
-from jose import JWTError, jwt
 
 
 # to get a string like this run:
@@ -14,8 +19,6 @@ SECRET_KEY = "09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 31000
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 credentials_exception = HTTPException(
     status_code=status.HTTP_401_UNAUTHORIZED,
     detail="Could not validate credentials",
@@ -28,6 +31,7 @@ def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
+    from jose import jwt      # imported on first use, keeps it out of cold starts
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -48,7 +52,8 @@ def get_user(username: str, db: Session):
     return user
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def decode_token(token: str) -> dict:
+    from jose import JWTError, jwt
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -56,12 +61,97 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
             raise credentials_exception
     except JWTError:
         raise credentials_exception
+    return payload
+
+
+# token -> (claims, detached user snapshot)
+# saves the jwt decode and the users lookup on every authenticated request
+auth_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
 
-    user = get_user(username, db)
-    # Optional: if you have a `disabled` field in your User model
-    # disabled = Column(Boolean, default=False)
 
-    # if getattr(user, "disabled", False):
-    #     raise HTTPException(status_code=400, detail="Inactive user")
+def snapshot_user(user: User) -> User:
+    snapshot = User(**{column.key: getattr(user, column.key) for column in User.__table__.columns})
+    make_transient_to_detached(snapshot)
+    return snapshot
 
+
+def _cached_user(token: str, db: Session):
+    # the cached user attached to `db` without a query, or None
+    cached = auth_cache.get(token)
+    if cached is None:
+        return None
+    claims, snapshot = cached
+    return db.merge(snapshot, load=False)
+
+
+def _load_user(token: str, db: Session) -> User:
+    claims = decode_token(token)
+    user = get_user(claims["sub"], db)
+    ttl = min(AUTH_CACHE_TTL, claims.get("exp", time.time() + AUTH_CACHE_TTL) - time.time())
+    auth_cache.set(token, (claims, snapshot_user(user)), ttl=ttl)
     return user
+
+
+def _active(user: User) -> User:
+    if user.disabled:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    return user
+
+
+def authenticate(token: str, db: Session) -> User:
+    return _active(_cached_user(token, db) or _load_user(token, db))
+
+
+def _drop_user(user_id: int = None):
+    # None: every user, after a bulk statement on users
+    if user_id is None:
+        auth_cache.clear()
+    else:
+        auth_cache.discard_where(lambda token, entry: entry[1].id == user_id)
+
+
+def invalidate_user(user_id: int = None):
+    _drop_user(user_id)
+    channel.publish("user", *([] if user_id is None else [user_id]))
+
+
+channel.subscribe("user", _drop_user)
+
+
+# any committed change to a user row (update_user, delete_user, the disabled
+# flag, ...) drops the cached snapshots of that user
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _mark_user_stale(mapper, connection, target):
+    object_session(target).info.setdefault("stale_users", set()).add(target.id)
+
+
+# bulk update(User)/delete(User) statements skip the mapper events and don't
+# say which rows they changed: they drop every cached user
+@event.listens_for(Session, "do_orm_execute")
+def _mark_users_stale(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, "table", None)
+        if table is not None and table.name == User.__tablename__:
+            orm_execute_state.session.info["stale_all_users"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _drop_stale_users(session):
+    if session.info.pop("stale_all_users", False):
+        session.info.pop("stale_users", None)
+        invalidate_user()
+    for user_id in session.info.pop("stale_users", ()):
+        invalidate_user(user_id)
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    user = _cached_user(token, db)
+    if user is None:
+        # decoding and the users lookup, off the event loop
+        user = await run_in_threadpool(_load_user, token, db)
+    return _active(user)
+
+
+async def get_current_user_async(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(lambda session: authenticate(token, session))
@@ -1,28 +1,84 @@
+import time
+started = time.perf_counter()
+
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from routers import auth, blog, category, user, comment, like, tag
-from database import engine
-import models
+from config import ASYNC_DB, AUTO_MIGRATE, COUNTER_RECONCILE_INTERVAL, HISTORY_PRUNE_INTERVAL, METRICS
+from database import async_engine, async_read_engine, engine, read_engine
+import counters
+import history
+from invalidation import channel
+from jobs import runner
+import metrics
+import migrations
+from responses import JSONResponse
+from related import related_updater
+from trending import trending_updater
+from views import view_buffer
+
+imported = time.perf_counter()
 
+# maintenance on the background job runner (jobs.py), in this order on shutdown:
+# buffered views mark blogs for the trending and related updates
+runner.every("view-flush", view_buffer.flush_interval, view_buffer.flush, final=True)
+runner.every(trending_updater.name, trending_updater.interval, trending_updater.run_once, final=True)
+runner.every(related_updater.name, related_updater.interval, related_updater.run_once, final=True)
+runner.every("counter-reconcile", COUNTER_RECONCILE_INTERVAL, counters.reconcile, singleton=True)
+runner.every("history-prune", HISTORY_PRUNE_INTERVAL, history.prune, singleton=True)
 
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    models.Base.metadata.create_all(engine)
-    print("Application startup")
+    lifespan_started = time.perf_counter()
+    # schema changes are versioned migrations, applied once per database
+    if AUTO_MIGRATE:
+        migrations.upgrade(engine)
+    else:
+        version = migrations.current_version(engine)
+        if version < migrations.LATEST:
+            raise RuntimeError(f"schema version {version}, expected {migrations.LATEST}: run python migrations.py upgrade")
+    migrated = time.perf_counter()
+
+    channel.start()
+    await runner.start()
+    ready = time.perf_counter()
+
+    startup = {
+        "imports": imported - started,
+        "migrations": migrated - lifespan_started,
+        "background": ready - migrated,
+        "total": ready - started,
+    }
+    metrics.registry.startup = startup
+    print("Application startup in {total:.0f}ms (imports {imports:.0f}ms, migrations {migrations:.0f}ms, "
+          "background jobs {background:.0f}ms)".format(**{name: seconds * 1000 for name, seconds in startup.items()}))
     yield
+    await runner.stop()
+    channel.stop()
+    if async_engine is not None:
+        await async_engine.dispose()
     print("Application shutdown")
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=JSONResponse)
+
+if METRICS:
+    app.add_middleware(metrics.MetricsMiddleware)
+    app.include_router(metrics.router)
+    instrumented = {engine, read_engine}
+    instrumented.update(e.sync_engine for e in (async_engine, async_read_engine) if e is not None)
+    for instrumented_engine in instrumented:
+        metrics.instrument(instrumented_engine)
 
 app.include_router(auth.router)
-app.include_router(user.router)
-app.include_router(blog.router)
-app.include_router(comment.router)
-app.include_router(like.router)
-app.include_router(category.router)
-app.include_router(tag.router)
+
+for module in (user, blog, comment, like, category, tag):
+    if ASYNC_DB:
+        from routers.aio import async_router
+        app.include_router(async_router(module.router))
+    else:
+        app.include_router(module.router)
 
 
 '''
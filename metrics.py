@@ -0,0 +1,253 @@
+'''
+Per-request timing and SQL instrumentation.
+
+`MetricsMiddleware` times every request and, through cursor events on the
+engines, counts its SQL statements, their total time and the slowest one.
+The numbers go out as a Server-Timing header on the response:
+
+    Server-Timing: app;dur=12.4, db;dur=3.1;desc="4 queries", db-slowest;dur=1.9
+
+and are aggregated per route for Prometheus on GET /metrics. Statements are
+attributed to the request through a context variable, which the threadpool
+and the async session both carry over; background jobs (jobs.py) are
+not counted per route but have metrics of their own.
+
+Statements of a streamed body run after the headers are sent and only show
+up in the totals.
+'''
+import logging
+import threading
+import time
+from contextvars import ContextVar
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import event
+
+from config import PROFILE_SLOW_MS
+import passwords
+import profiler
+
+logger = logging.getLogger(__name__)
+
+# seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+SLOW_STATEMENT_LOG = 0.5
+
+
+class RequestStats:
+
+    __slots__ = ("statements", "db_seconds", "slowest_seconds", "slowest_statement")
+
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_statement = None
+
+    def add(self, statement: str, seconds: float):
+        self.statements += 1
+        self.db_seconds += seconds
+        if seconds > self.slowest_seconds:
+            self.slowest_seconds = seconds
+            self.slowest_statement = statement
+
+
+_current: ContextVar = ContextVar("request_stats", default=None)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)     # the last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+
+    def lines(self, name: str, labels: str):
+        cumulative = 0
+        prefix = labels + "," if labels else ""
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}'
+        labels = f"{{{labels}}}" if labels else ""
+        yield f"{name}_sum{labels} {self.sum:.6f}"
+        yield f"{name}_count{labels} {cumulative}"
+
+
+class Registry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}          # (method, route, status) -> count
+        self.durations = {}         # route -> Histogram
+        self.db_statements = {}     # route -> count
+        self.db_seconds = {}        # route -> seconds
+        self.statement_durations = Histogram(STATEMENT_BUCKETS)
+        self.startup = {}           # phase -> seconds, set by main.lifespan
+        self.job_durations = {}     # job name -> Histogram
+        self.job_retries = {}       # job name -> count
+        self.job_failures = {}      # job name -> count, after the last retry
+        self.job_wait = Histogram(DURATION_BUCKETS)
+        self.job_queue_depth = lambda: 0       # set by jobs.runner
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float, stats: RequestStats):
+        with self._lock:
+            key = (method, route, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.durations.setdefault(route, Histogram(DURATION_BUCKETS)).observe(seconds)
+            self.db_statements[route] = self.db_statements.get(route, 0) + stats.statements
+            self.db_seconds[route] = self.db_seconds.get(route, 0.0) + stats.db_seconds
+
+    def observe_statement(self, seconds: float):
+        with self._lock:
+            self.statement_durations.observe(seconds)
+
+    def observe_job(self, name: str, seconds: float, retried: bool = False, failed: bool = False):
+        with self._lock:
+            self.job_durations.setdefault(name, Histogram(DURATION_BUCKETS)).observe(seconds)
+            if retried:
+                self.job_retries[name] = self.job_retries.get(name, 0) + 1
+            if failed:
+                self.job_failures[name] = self.job_failures.get(name, 0) + 1
+
+    def observe_job_wait(self, seconds: float):
+        with self._lock:
+            self.job_wait.observe(seconds)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            lines.append("# TYPE http_requests_total counter")
+            for (method, route, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{method="{method}",route="{route}",status="{status}"}} {count}')
+
+            lines.append("# TYPE http_request_duration_seconds histogram")
+            for route, histogram in sorted(self.durations.items()):
+                lines.extend(histogram.lines("http_request_duration_seconds", f'route="{route}"'))
+
+            lines.append("# TYPE db_statements_total counter")
+            for route, count in sorted(self.db_statements.items()):
+                lines.append(f'db_statements_total{{route="{route}"}} {count}')
+
+            lines.append("# TYPE db_seconds_total counter")
+            for route, seconds in sorted(self.db_seconds.items()):
+                lines.append(f'db_seconds_total{{route="{route}"}} {seconds:.6f}')
+
+            lines.append("# TYPE db_statement_duration_seconds histogram")
+            lines.extend(self.statement_durations.lines("db_statement_duration_seconds", ""))
+
+            lines.append("# TYPE app_startup_seconds gauge")
+            for phase, seconds in self.startup.items():
+                lines.append(f'app_startup_seconds{{phase="{phase}"}} {seconds:.6f}')
+
+            lines.append("# TYPE job_duration_seconds histogram")
+            for name, histogram in sorted(self.job_durations.items()):
+                lines.extend(histogram.lines("job_duration_seconds", f'job="{name}"'))
+
+            lines.append("# TYPE job_retries_total counter")
+            for name, count in sorted(self.job_retries.items()):
+                lines.append(f'job_retries_total{{job="{name}"}} {count}')
+
+            lines.append("# TYPE job_failures_total counter")
+            for name, count in sorted(self.job_failures.items()):
+                lines.append(f'job_failures_total{{job="{name}"}} {count}')
+
+            lines.append("# TYPE job_queue_wait_seconds histogram")
+            lines.extend(self.job_wait.lines("job_queue_wait_seconds", ""))
+
+        lines.append("# TYPE job_queue_depth gauge")
+        lines.append(f"job_queue_depth {self.job_queue_depth()}")
+
+        hashing = passwords.stats()
+        lines.append("# TYPE password_hash_pending gauge")
+        lines.append(f"password_hash_pending {hashing['pending']}")
+        lines.append("# TYPE password_hash_rejected_total counter")
+        lines.append(f"password_hash_rejected_total {hashing['rejected']}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def instrument(engine):
+    # time every statement run on `engine` and charge it to the current request
+    # the start is kept on the statement's execution context, which goes
+    # away with it when the statement raises
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        context._query_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - context._query_start
+        registry.observe_statement(seconds)
+        stats = _current.get()
+        if stats is not None:
+            stats.add(statement, seconds)
+        if seconds >= SLOW_STATEMENT_LOG:
+            logger.warning("slow statement (%.3fs): %s", seconds, statement)
+
+
+def _server_timing(seconds: float, stats: RequestStats) -> bytes:
+    return (
+        f'app;dur={seconds * 1000:.1f}, '
+        f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.statements} queries", '
+        f'db-slowest;dur={stats.slowest_seconds * 1000:.1f}'
+    ).encode()
+
+
+class MetricsMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        samples = profiler.sampler.begin() if PROFILE_SLOW_MS else None
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", _server_timing(time.perf_counter() - started, stats)))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            seconds = time.perf_counter() - started
+            _current.reset(token)
+            route = scope.get("route")
+            route = getattr(route, "path", "unmatched")
+            registry.observe_request(scope["method"], route, status, seconds, stats)
+            if samples is not None:
+                profiler.sampler.end(samples)
+                if seconds * 1000 >= PROFILE_SLOW_MS:
+                    profiler.dump(samples, scope["method"], route, seconds, stats.slowest_statement)
+
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
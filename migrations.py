@@ -0,0 +1,196 @@
+'''
+Versioned schema migrations.
+
+Each step in MIGRATIONS runs once per database, in its own transaction, and
+is recorded in the schema_migrations table. At startup main.py only reads
+the current version (one query) and applies the missing steps when
+AUTO_MIGRATE is on; with AUTO_MIGRATE=0 they are applied ahead of a deploy:
+
+    python migrations.py upgrade
+    python migrations.py status
+
+Steps also have to work on databases created by the `create_all` the app
+used to run on every start, so they check what is there before changing it.
+Add new steps at the end, never edit or reorder applied ones.
+'''
+import logging
+import time
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, text
+from sqlalchemy.exc import IntegrityError
+
+import feed
+import models
+import related
+import search
+import trending
+
+logger = logging.getLogger(__name__)
+
+schema_migrations = Table(
+    'schema_migrations',
+    MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('name', String, nullable=False),
+    Column('applied_at', DateTime, server_default=func.now()),
+)
+
+BASE_TABLES = (
+    models.User.__table__, models.Category.__table__, models.Tag.__table__, models.Blog.__table__,
+    models.blog_tag, models.favourite_blog_table, models.History.__table__,
+    models.Like.__table__, models.Comment.__table__,
+)
+
+
+def base_schema(connection):
+    for table in BASE_TABLES:
+        table.create(connection, checkfirst=True)
+
+
+def tag_names_as_text(connection):
+    # tags.name used to be declared INTEGER; on SQLite that makes "2024"
+    # stored as a number, which then never equals the string '2024'
+    columns = {column["name"]: column for column in inspect(connection).get_columns("tags")}
+    if not isinstance(columns["name"]["type"], Integer):
+        return
+    if connection.dialect.name != "sqlite":
+        connection.execute(text("ALTER TABLE tags ALTER COLUMN name TYPE VARCHAR USING CAST(name AS VARCHAR)"))
+        return
+    connection.execute(text("CREATE TEMP TABLE tags_backup AS SELECT id, CAST(name AS TEXT) AS name FROM tags"))
+    connection.execute(text("DROP TABLE tags"))
+    models.Tag.__table__.create(connection)
+    connection.execute(text("INSERT INTO tags (id, name) SELECT id, name FROM tags_backup"))
+    connection.execute(text("DROP TABLE tags_backup"))
+
+
+def indexes(connection):
+    # keyset pagination and join indexes declared in models.py; unique ones
+    # need their data cleaned up first and have their own step
+    for table in BASE_TABLES:
+        for index in table.indexes:
+            if not index.unique:
+                index.create(connection, checkfirst=True)
+
+
+TIMESTAMP_COLUMNS = (
+    ("blogs", "time_created"), ("blogs", "time_updated"), ("likes", "time_liked"),
+    ("comments", "time_commented"), ("comments", "time_updated"),
+    ("history", "viewed_at"), ("favourite_blog", "added_at"),
+)
+
+
+def timestamps_without_fraction(connection):
+    # models.timestamp stores SQLite times as CURRENT_TIMESTAMP does; older
+    # rows written from Python carry microseconds
+    if connection.dialect.name != "sqlite":
+        return
+    for table, column in TIMESTAMP_COLUMNS:
+        connection.execute(text(f"UPDATE {table} SET {column} = substr({column}, 1, 19) WHERE length({column}) > 19"))
+
+
+def full_text_index(connection):
+    search.ensure_index(connection)
+
+
+def blog_feed(connection):
+    models.blog_feed.create(connection, checkfirst=True)
+    feed.ensure_index(connection)
+
+
+def unique_likes(connection):
+    # one like per (blog, user): drop duplicates, keeping the first, then
+    # recount and enforce it; the unique index also serves blog_id lookups
+    connection.execute(text("DROP INDEX IF EXISTS idx_like_blog"))
+    connection.execute(text(
+        "DELETE FROM likes WHERE id NOT IN (SELECT min(id) FROM likes GROUP BY blog_id, reactor_id)"
+    ))
+    connection.execute(text(
+        "UPDATE blogs SET likes_count = (SELECT count(*) FROM likes WHERE likes.blog_id = blogs.id)"
+    ))
+    for index in models.Like.__table__.indexes:
+        if index.unique:
+            index.create(connection, checkfirst=True)
+
+
+def blog_trending(connection):
+    models.blog_trending.create(connection, checkfirst=True)
+    trending.rebuild(connection)
+
+
+def blog_related(connection):
+    for index in (*models.blog_tag.indexes, *models.History.__table__.indexes):
+        index.create(connection, checkfirst=True)
+    models.blog_related.create(connection, checkfirst=True)
+    related.rebuild(connection)
+
+
+MIGRATIONS = [
+    (1, "base schema", base_schema),
+    (2, "tags.name as text", tag_names_as_text),
+    (3, "indexes", indexes),
+    (4, "sqlite timestamps without fraction", timestamps_without_fraction),
+    (5, "blog_fts full-text index", full_text_index),
+    (6, "blog_feed read model", blog_feed),
+    (7, "unique likes per user", unique_likes),
+    (8, "blog_trending scores", blog_trending),
+    (9, "blog_related neighbours", blog_related),
+]
+LATEST = MIGRATIONS[-1][0]
+
+
+def _version(connection) -> int:
+    return connection.execute(select(func.max(schema_migrations.c.version))).scalar() or 0
+
+
+def current_version(engine) -> int:
+    with engine.connect() as connection:
+        if not inspect(connection).has_table(schema_migrations.name):
+            return 0
+        return _version(connection)
+
+
+def upgrade(engine) -> list:
+    # -> versions applied by this call
+    done = current_version(engine)
+    if done >= LATEST:
+        # the usual boot: no DDL, no write lock
+        return []
+    schema_migrations.create(engine, checkfirst=True)
+    applied = []
+    for version, name, step in MIGRATIONS:
+        if version <= done:
+            continue
+        started = time.perf_counter()
+        try:
+            with engine.begin() as connection:
+                if connection.dialect.name == "sqlite":
+                    # pysqlite runs DDL outside of transactions unless one is
+                    # open; take the write lock so the step is atomic and
+                    # workers starting together wait for each other
+                    connection.exec_driver_sql("BEGIN IMMEDIATE")
+                # checked again under the lock: another worker may be ahead
+                if version <= _version(connection):
+                    continue
+                step(connection)
+                connection.execute(schema_migrations.insert().values(version=version, name=name))
+        except IntegrityError:
+            # another worker applied it first; its transaction won, ours rolled back
+            continue
+        logger.info("migration %d (%s) applied in %.2fs", version, name, time.perf_counter() - started)
+        applied.append(version)
+    return applied
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="database schema migrations")
+    parser.add_argument("command", choices=["upgrade", "status"])
+    args = parser.parse_args()
+
+    if args.command == "upgrade":
+        applied = upgrade(engine)
+        print(f"applied {applied}" if applied else "nothing to apply")
+    print(f"schema version {current_version(engine)}, latest {LATEST}")
@@ -1,14 +1,26 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Index, Integer, String, DateTime, Table, exists
-from sqlalchemy.orm import relationship
+from sqlalchemy import Boolean, Column, ForeignKey, Float, Index, Integer, String, DateTime, Table, exists, select
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.orm import joinedload, relationship, selectinload
 from sqlalchemy.sql import func
 from database import Base
 
 
+def timestamp(timezone=False):
+    # on SQLite, stored the way CURRENT_TIMESTAMP writes them (no fraction) so
+    # server defaults and values written from Python compare alike
+    return DateTime(timezone=timezone).with_variant(
+        sqlite.DATETIME(
+            storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d",
+        ),
+        "sqlite",
+    )
+
 blog_tag = Table(
     'blog_tag', 
     Base.metadata,
     Column('blog_id', ForeignKey('blogs.id', ondelete="CASCADE"), primary_key=True),
     Column('tag_id', ForeignKey('tags.id', ondelete="CASCADE"), primary_key=True),
+    Index('idx_blog_tag_tag', 'tag_id', 'blog_id'),
 )
 
 favourite_blog_table = Table(
@@ -16,21 +28,70 @@ favourite_blog_table = Table(
     Base.metadata,
     Column('user_id', ForeignKey('users.id', ondelete="CASCADE"), primary_key=True),
     Column('blog_id', ForeignKey('blogs.id', ondelete="CASCADE"), primary_key=True),
-    Column('added_at', DateTime, server_default=func.now()),
+    Column('added_at', timestamp(), server_default=func.now()),
     Index('idx_favorite_user', 'user_id'),
     Index('idx_favorite_blog', 'blog_id'),
+    Index('idx_favorite_user_added', 'user_id', 'added_at', 'blog_id'),     # keyset pagination
+)
+
+# read model for /blog/query, maintained by feed.py: one row per blog for each
+# (category, tag) filter it matches, 0 standing for "any"
+blog_feed = Table(
+    'blog_feed',
+    Base.metadata,
+    Column('category_id', Integer, primary_key=True),
+    Column('tag_id', Integer, primary_key=True),
+    Column('time_created', timestamp(timezone=True), primary_key=True),
+    Column('blog_id', ForeignKey('blogs.id', ondelete="CASCADE"), primary_key=True),
+    Index('idx_feed_blog', 'blog_id'),
+)
+
+# read model for /blog/trending, maintained by trending.py
+blog_trending = Table(
+    'blog_trending',
+    Base.metadata,
+    Column('blog_id', ForeignKey('blogs.id', ondelete="CASCADE"), primary_key=True),
+    Column('score', Float, nullable=False),
+    Index('idx_trending_score', 'score', 'blog_id'),
+)
+
+# read model for /blog/{id}/related and /user/recommended, maintained by
+# related.py: the RELATED_TOP_K most similar blogs of each blog, by rank
+blog_related = Table(
+    'blog_related',
+    Base.metadata,
+    Column('blog_id', ForeignKey('blogs.id', ondelete="CASCADE"), primary_key=True),
+    Column('rank', Integer, primary_key=True),
+    Column('related_id', ForeignKey('blogs.id', ondelete="CASCADE"), nullable=False),
+    Column('score', Float, nullable=False),
+    Index('idx_related_related', 'related_id'),
 )
 
 class History(Base):
     __tablename__ = 'history'
+    __table_args__ = (
+        Index('idx_history_user_viewed', 'user_id', 'viewed_at', 'blog_id'),
+        Index('idx_history_blog', 'blog_id'),
+    )
 
     user_id = Column(Integer, ForeignKey('users.id', ondelete="CASCADE"), primary_key=True)
     blog_id = Column(Integer, ForeignKey('blogs.id', ondelete="CASCADE"), primary_key=True)
-    viewed_at = Column(DateTime, server_default=func.now())
+    viewed_at = Column(timestamp(), server_default=func.now())
 
     user = relationship("User", back_populates="history")
     blog = relationship("Blog", back_populates="history")
 
+    @staticmethod
+    def last_viewed(user_id, blog_ids, db) -> dict:
+        # {blog_id: viewed_at} for those of `blog_ids` the user has viewed
+        if not blog_ids:
+            return {}
+        return dict(db.execute(
+            select(History.blog_id, History.viewed_at).where(
+                History.user_id == user_id, History.blog_id.in_(blog_ids),
+            )
+        ).all())
+
 
 
 class User(Base):
@@ -56,14 +117,18 @@ class User(Base):
 
 class Blog(Base):
     __tablename__ = "blogs"
+    __table_args__ = (
+        Index('idx_blog_created', 'time_created', 'id'),
+        Index('idx_blog_author_created', 'author_id', 'time_created', 'id'),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, nullable=False)
     body = Column(String, nullable=False)
     # search_vector = Column(TSVectorType('title', 'content'))  # Special column for full-text search (postgresql)
 
-    time_created = Column(DateTime(timezone=True), server_default=func.now())
-    time_updated = Column(DateTime(timezone=True), server_default=func.now())
+    time_created = Column(timestamp(timezone=True), server_default=func.now())
+    time_updated = Column(timestamp(timezone=True), server_default=func.now())
 
     likes_count = Column(Integer, default=0)
     comments_count = Column(Integer, default=0)
@@ -89,19 +154,40 @@ class Blog(Base):
     '''
     history = relationship('History', back_populates='blog')
 
-    def is_favorited(self, user_id, blog_id, db):
+    @property
+    def category_name(self):
+        return self.category.name if self.category is not None else None
+
+    @staticmethod
+    def is_favorited(user_id, blog_id, db):
         return db.query(
             exists().where(
                 favourite_blog_table.c.user_id == user_id,
                 favourite_blog_table.c.blog_id == blog_id,
             )
-        )
+        ).scalar()
+
+    @staticmethod
+    def favorited_blog_ids(user_id, blog_ids, db) -> set:
+        # which of `blog_ids` the user favorited, in one query
+        if not blog_ids:
+            return set()
+        return set(db.execute(
+            select(favourite_blog_table.c.blog_id).where(
+                favourite_blog_table.c.user_id == user_id,
+                favourite_blog_table.c.blog_id.in_(blog_ids),
+            )
+        ).scalars())
 
 class Like(Base):
     __tablename__ = "likes"
+    __table_args__ = (
+        Index('uq_like_blog_reactor', 'blog_id', 'reactor_id', unique=True),      # one like per user
+        Index('idx_like_reactor_time', 'reactor_id', 'time_liked', 'id'),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    time_liked = Column(DateTime(timezone=True), server_default=func.now())
+    time_liked = Column(timestamp(timezone=True), server_default=func.now())
     
     reactor_id = Column(Integer, ForeignKey("users.id"))
     liked_by = relationship("User", back_populates="likes")
@@ -109,13 +195,26 @@ class Like(Base):
     blog_id = Column(Integer, ForeignKey("blogs.id"))
     blog = relationship("Blog", back_populates="likes")
 
+    @staticmethod
+    def liked_blog_ids(user_id, blog_ids, db) -> set:
+        # which of `blog_ids` the user liked, in one query
+        if not blog_ids:
+            return set()
+        return set(db.execute(
+            select(Like.blog_id).where(Like.reactor_id == user_id, Like.blog_id.in_(blog_ids))
+        ).scalars())
+
 class Comment(Base):
     __tablename__ = 'comments'
+    __table_args__ = (
+        Index('idx_comment_blog', 'blog_id'),
+        Index('idx_comment_commenter_time', 'commenter_id', 'time_commented', 'id'),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     body = Column(String, nullable=False)
-    time_commented = Column(DateTime(timezone=True), server_default=func.now())
-    time_updated = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    time_commented = Column(timestamp(timezone=True), server_default=func.now())
+    time_updated = Column(timestamp(timezone=True), server_default=func.now(), onupdate=func.now())
 
     commenter_id = Column(Integer, ForeignKey("users.id"))
     commenter = relationship("User", back_populates="comments")
@@ -136,7 +235,21 @@ class Tag(Base):
     __tablename__ = 'tags'
 
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(Integer, nullable=False, unique=True)
+    name = Column(String, nullable=False, unique=True)
 
     blogs = relationship("Blog", secondary=blog_tag, back_populates='tags')
 
+
+def columns(entity, schema):
+    # the columns of `entity` a response schema reads; read-only listings
+    # select only these, as rows, skipping ORM instances and the identity map
+    return [getattr(entity, name) for name in schema.model_fields]
+
+
+# everything schemas.blog.BlogOut reads, loaded for a whole page in a fixed
+# number of queries: the category joined into the blogs SELECT and all the
+# tags of the page in one SELECT ... WHERE blog_id IN (...)
+blog_out_options = (
+    joinedload(Blog.category),
+    selectinload(Blog.tags),
+)
@@ -0,0 +1,96 @@
+'''
+Keyset (cursor) pagination.
+
+Listings are ordered by a unique key, newest first, e.g. (time_created, id),
+and the next page starts strictly after the last row of the previous one:
+
+    WHERE (time_created, id) < (:last_time, :last_id)
+    ORDER BY time_created DESC, id DESC LIMIT :limit
+
+With a matching index this costs the same for page N as for page 1. The
+cursor handed to clients is the last key, base64 encoded; the list
+endpoints return it in the X-Next-Cursor header (absent on the last page).
+'''
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from fastapi import HTTPException, Query, Response, status
+from sqlalchemy import DateTime, String, tuple_, type_coerce
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+CursorQuery = Query(None, description="opaque cursor from the X-Next-Cursor header of the previous page")
+LimitQuery = Query(10, ge=1, le=100)
+
+
+def encode_cursor(values) -> str:
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, columns) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError(cursor)
+        return [
+            datetime.fromisoformat(value) if isinstance(column.type, DateTime) else value
+            for column, value in zip(columns, values)
+        ]
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="invalid cursor")
+
+
+def sqlite_timestamp(value: datetime) -> str:
+    # SQLite keeps timestamps as text, without a fraction for CURRENT_TIMESTAMP
+    # defaults and models.timestamp columns, with 6 digits for rows written
+    # before those existed. Comparing the text as stored keeps the key order
+    # identical to ORDER BY.
+    if value.microsecond:
+        return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _comparable(query, columns, values):
+    if query.session.bind.dialect.name != "sqlite":
+        return columns, values
+    comparable_columns, comparable_values = [], []
+    for column, value in zip(columns, values):
+        if isinstance(value, datetime):
+            column, value = type_coerce(column, String), sqlite_timestamp(value)
+        comparable_columns.append(column)
+        comparable_values.append(value)
+    return comparable_columns, comparable_values
+
+
+def keyset(query, columns, cursor: str = None):
+    # `query` ordered by `columns`, newest first, starting after `cursor`
+    if cursor:
+        values = decode_cursor(cursor, columns)
+        comparable_columns, values = _comparable(query, columns, values)
+        query = query.filter(tuple_(*comparable_columns) < tuple_(*values))
+    return query.order_by(*[column.desc() for column in columns])
+
+
+def paginate(query, columns, cursor: str = None, limit: int = 10, key=None):
+    '''
+    -> (rows, next_cursor). `columns` is the unique sort key, `key(row)`
+    extracts its values from a result row (defaults to the attributes of
+    the same name).
+    '''
+    if key is None:
+        key = lambda row: [getattr(row, column.key) for column in columns]
+
+    rows = keyset(query, columns, cursor).limit(limit + 1).all()
+
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(key(rows[-1]))
+
+
+def set_next_cursor(response: Response, next_cursor):
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
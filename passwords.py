@@ -0,0 +1,72 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+
+from config import BCRYPT_ROUNDS, HASH_MAX_PENDING, HASH_WORKERS
+
+
+@functools.lru_cache(maxsize=None)
+def pwd_context():
+    # passlib and bcrypt are imported on the first password check, on a
+    # hashing thread, instead of at startup
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+def _hash(password: str) -> str:
+    return pwd_context().hash(password)
+
+
+def _verify_and_update(password: str, hashed: str):
+    return pwd_context().verify_and_update(password, hashed)
+
+
+# bcrypt releases the GIL, so a small dedicated thread pool is enough to keep
+# hashing off the threadpool the sync endpoints share
+_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+_lock = threading.Lock()
+_stats = {"pending": 0, "hashed": 0, "verified": 0, "rehashed": 0, "rejected": 0}
+
+
+def stats() -> dict:
+    # pending = waiting for a worker + being hashed
+    with _lock:
+        return dict(_stats, workers=HASH_WORKERS, max_pending=HASH_MAX_PENDING)
+
+
+async def _submit(fn, *args):
+    with _lock:
+        if _stats["pending"] >= HASH_MAX_PENDING:
+            _stats["rejected"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many password checks in progress, try again",
+                headers={"Retry-After": "1"},
+            )
+        _stats["pending"] += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+    finally:
+        with _lock:
+            _stats["pending"] -= 1
+
+
+async def hash_password(password: str) -> str:
+    hashed = await _submit(_hash, password)
+    with _lock:
+        _stats["hashed"] += 1
+    return hashed
+
+
+async def verify_password(password: str, hashed: str):
+    # -> (valid, new_hash); new_hash is set when the stored hash needs an
+    # update (e.g. BCRYPT_ROUNDS changed) and should replace it
+    valid, new_hash = await _submit(_verify_and_update, password, hashed)
+    with _lock:
+        _stats["verified"] += 1
+        if new_hash:
+            _stats["rehashed"] += 1
+    return valid, new_hash
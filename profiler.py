@@ -0,0 +1,91 @@
+'''
+Opt-in sampling profiler for slow requests (PROFILE_SLOW_MS > 0).
+
+While at least one request is in flight a background thread snapshots the
+stacks of all threads every PROFILE_INTERVAL_MS, so handlers running on the
+threadpool are seen as well as the event loop. Each request collects the
+samples taken during its lifetime; if it ends up slower than PROFILE_SLOW_MS
+they are written to PROFILE_DIR as collapsed stacks, one
+"frame;frame;frame count" line per stack, ready for flamegraph.pl or
+speedscope. Concurrent requests share samples, so a profile shows what the
+process was doing, not only the slow request.
+'''
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from config import PROFILE_DIR, PROFILE_INTERVAL_MS
+
+# innermost frames of threads that are only waiting
+IDLE_FILES = ("threading.py", "selectors.py", "queue.py", "thread.py")
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Sampler:
+
+    def __init__(self, interval: float = PROFILE_INTERVAL_MS / 1000):
+        self.interval = interval
+        self._active = []           # Counters of the requests in flight
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def begin(self) -> Counter:
+        samples = Counter()
+        with self._lock:
+            self._active.append(samples)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return samples
+
+    def end(self, samples: Counter):
+        with self._lock:
+            self._active.remove(samples)
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            with self._lock:
+                active = list(self._active)
+            if not active:
+                self._wake.clear()
+                self._wake.wait()
+                continue
+
+            stacks = Counter()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or os.path.basename(frame.f_code.co_filename) in IDLE_FILES:
+                    continue
+                stacks[_collapse(frame)] += 1
+            for samples in active:
+                samples.update(stacks)
+            time.sleep(self.interval)
+
+
+sampler = Sampler()
+
+
+def dump(samples: Counter, method: str, route: str, seconds: float, slowest_statement=None) -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = re.sub(r"[^\w.-]+", "_", f"{method}{route}").strip("_")
+    path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{int(seconds * 1000)}ms-{name}.txt")
+    with open(path, "w") as file:
+        file.write(f"# {method} {route} {seconds * 1000:.1f}ms\n")
+        if slowest_statement:
+            file.write('# slowest statement: "' + " ".join(slowest_statement.split()) + '"\n')
+        for stack, count in samples.most_common():
+            file.write(f"{stack} {count}\n")
+    return path
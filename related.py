@@ -0,0 +1,299 @@
+'''
+Related blogs (the blog_related read model behind /blog/{id}/related and
+/user/recommended).
+
+Each blog is a sparse vector of binary features: its tags, the users who
+favourited it, liked it and viewed it, weighted by WEIGHTS. Two blogs are
+as related as the cosine of their vectors, and blog_related keeps the
+RELATED_TOP_K nearest of every blog, so requests only read precomputed rows.
+Features shared by more than RELATED_MAX_DF blogs (a tag on everything, a
+user who read everything) say little and are left out of the dot products.
+
+`rebuild` computes every list. With numpy and scipy installed (optional,
+`pip install numpy scipy`) that is a few sparse matrix products; without
+them it is the same accumulation over posting lists that `update` uses.
+
+`update` recomputes the lists of the blogs marked dirty (new tags, likes,
+favourites or views; `related_updater.mark`) every RELATED_INTERVAL seconds
+and, similarity being symmetric, merges their new scores into their
+neighbours' lists. Those other lists are patched rather than recomputed
+(a blog's vector length changes too, and scores can go down), so they
+drift a little until the next full rebuild, e.g. nightly:
+
+    python related.py rebuild
+'''
+import heapq
+import math
+from collections import defaultdict
+
+from sqlalchemy import delete, func, select, union
+
+from config import RELATED_INTERVAL, RELATED_MAX_DF, RELATED_TOP_K
+from database import SessionLocal
+from dirty import DirtyUpdater
+import models
+
+try:
+    import numpy
+    from scipy import sparse
+except ImportError:     # optional
+    numpy = sparse = None
+
+related = models.blog_related
+blogs = models.Blog.__table__
+history = models.History.__table__
+likes = models.Like.__table__
+favourites = models.favourite_blog_table
+
+# kind -> (blog column, feature column)
+SOURCES = {
+    "tag": (models.blog_tag.c.blog_id, models.blog_tag.c.tag_id),
+    "favourite": (favourites.c.blog_id, favourites.c.user_id),
+    "like": (likes.c.blog_id, likes.c.reactor_id),
+    "view": (history.c.blog_id, history.c.user_id),
+}
+WEIGHTS = {"tag": 1.0, "favourite": 3.0, "like": 2.0, "view": 1.0}
+BATCH_SIZE = 500
+DIGITS = 9      # scores are rounded so both rebuilds rank ties the same, by id
+
+
+def _chunks(values, size: int = BATCH_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _features(db, blog_ids) -> dict:
+    # {blog_id: [(kind, key), ...]}
+    features = defaultdict(list)
+    for kind, (blog_column, key_column) in SOURCES.items():
+        for chunk in _chunks(blog_ids):
+            for blog_id, key in db.execute(select(blog_column, key_column).where(blog_column.in_(chunk))):
+                features[blog_id].append((kind, key))
+    return features
+
+
+def _postings(db, keys_by_kind) -> dict:
+    # {(kind, key): [blog_id, ...]} for the features that are not too common,
+    # of existing blogs (a deleted blog's blog_tag rows go in the background)
+    postings = defaultdict(list)
+    for kind, keys in keys_by_kind.items():
+        blog_column, key_column = SOURCES[kind]
+        for chunk in _chunks(keys):
+            rare = select(key_column).where(key_column.in_(chunk)).group_by(key_column).having(
+                func.count() <= RELATED_MAX_DF
+            )
+            rows = db.execute(
+                select(key_column, blog_column).where(key_column.in_(rare), blog_column.in_(select(blogs.c.id)))
+            )
+            for key, blog_id in rows:
+                postings[kind, key].append(blog_id)
+    return postings
+
+
+def _norms(db, blog_ids) -> dict:
+    # {blog_id: length of its feature vector}, over all of its features
+    squares = defaultdict(float)
+    for kind, (blog_column, _) in SOURCES.items():
+        for chunk in _chunks(blog_ids):
+            rows = db.execute(select(blog_column, func.count()).where(blog_column.in_(chunk)).group_by(blog_column))
+            for blog_id, count in rows:
+                squares[blog_id] += WEIGHTS[kind] ** 2 * count
+    return {blog_id: math.sqrt(square) for blog_id, square in squares.items()}
+
+
+def neighbours(db, blog_ids, top_k: int = RELATED_TOP_K) -> dict:
+    # {blog_id: [(related_id, score), ...] best first}
+    features = _features(db, blog_ids)
+    keys_by_kind = defaultdict(set)
+    for blog_features in features.values():
+        for kind, key in blog_features:
+            keys_by_kind[kind].add(key)
+    postings = _postings(db, keys_by_kind)
+    candidates = {blog_id for posting in postings.values() for blog_id in posting}
+    norms = _norms(db, candidates | set(features))
+
+    lists = {}
+    for blog_id in blog_ids:
+        dots = defaultdict(float)
+        for kind, key in features.get(blog_id, ()):
+            weight = WEIGHTS[kind] ** 2
+            for other in postings.get((kind, key), ()):
+                dots[other] += weight
+        dots.pop(blog_id, None)
+        scores = ((other, round(dot / (norms[blog_id] * norms[other]), DIGITS)) for other, dot in dots.items())
+        lists[blog_id] = heapq.nlargest(top_k, scores, key=lambda item: (item[1], -item[0]))
+    return lists
+
+
+def _store(db, lists: dict):
+    for chunk in _chunks(lists):
+        db.execute(delete(related).where(related.c.blog_id.in_(chunk)))
+    rows = [
+        {"blog_id": blog_id, "rank": rank, "related_id": other, "score": score}
+        for blog_id, pairs in lists.items() for rank, (other, score) in enumerate(pairs)
+    ]
+    for chunk in _chunks(rows, 5000):
+        db.execute(related.insert(), chunk)
+
+
+def _stored(db, blog_ids) -> dict:
+    lists = defaultdict(list)
+    for chunk in _chunks(blog_ids):
+        rows = db.execute(
+            select(related.c.blog_id, related.c.related_id, related.c.score)
+            .where(related.c.blog_id.in_(chunk)).order_by(related.c.blog_id, related.c.rank)
+        )
+        for blog_id, other, score in rows:
+            lists[blog_id].append((other, score))
+    return lists
+
+
+def update(db, blog_ids) -> int:
+    # recompute the lists of `blog_ids` and fold the new scores into the
+    # lists of the blogs they point to, in the caller's transaction
+    blog_ids = set(blog_ids)
+    existing = set()
+    for chunk in _chunks(blog_ids):
+        existing.update(db.execute(select(blogs.c.id).where(blogs.c.id.in_(chunk))).scalars())
+    remove_blogs(db, blog_ids - existing)      # marked, then deleted
+    lists = neighbours(db, existing)
+    back = defaultdict(dict)
+    for blog_id, pairs in lists.items():
+        for other, score in pairs:
+            if other not in lists:
+                back[other][blog_id] = score
+
+    merged = {}
+    stored = _stored(db, back)
+    for other, scores in back.items():
+        current = dict(stored.get(other, ()))
+        new = sorted({**current, **scores}.items(), key=lambda item: (-item[1], item[0]))[:RELATED_TOP_K]
+        if new != stored.get(other, []):
+            merged[other] = new
+    _store(db, {**lists, **merged})
+    return len(lists)
+
+
+def remove_blogs(db, blog_ids):
+    if blog_ids:
+        blog_ids = list(blog_ids)
+        db.execute(delete(related).where(related.c.blog_id.in_(blog_ids) | related.c.related_id.in_(blog_ids)))
+
+
+def _rebuild_sparse(db) -> dict:
+    ids = [blog_id for blog_id, in db.execute(select(blogs.c.id).order_by(blogs.c.id))]
+    if not ids:
+        return {}
+    row_of = {blog_id: row for row, blog_id in enumerate(ids)}
+    rows, columns, data, column_of = [], [], [], {}
+    for kind, (blog_column, key_column) in SOURCES.items():
+        for blog_id, key in db.execute(select(blog_column, key_column)).yield_per(10000):
+            if blog_id in row_of:
+                rows.append(row_of[blog_id])
+                columns.append(column_of.setdefault((kind, key), len(column_of)))
+                data.append(WEIGHTS[kind])
+    if not data:
+        return {blog_id: [] for blog_id in ids}
+    matrix = sparse.csr_matrix((data, (rows, columns)), shape=(len(ids), len(column_of)))
+    matrix.sum_duplicates()
+
+    norms = numpy.sqrt(numpy.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    frequency = numpy.diff(matrix.tocsc().indptr)
+    rare = sparse.diags((frequency <= RELATED_MAX_DF).astype(float))
+    vectors = (sparse.diags(1 / norms) @ matrix @ rare).tocsr()
+    transposed = vectors.T.tocsc()
+
+    lists = {}
+    for start in range(0, len(ids), BATCH_SIZE):
+        similarities = (vectors[start:start + BATCH_SIZE] @ transposed).tocsr()
+        for offset in range(similarities.shape[0]):
+            row = start + offset
+            begin, end = similarities.indptr[offset], similarities.indptr[offset + 1]
+            others, scores = similarities.indices[begin:end], similarities.data[begin:end]
+            keep = (others != row) & (scores > 0)
+            others, scores = others[keep], numpy.round(scores[keep], DIGITS)
+            order = numpy.lexsort((others, -scores))[:RELATED_TOP_K]
+            lists[ids[row]] = [(ids[others[i]], float(scores[i])) for i in order]
+    return lists
+
+
+def rebuild(db) -> int:
+    db.execute(delete(related))
+    if sparse is not None:
+        lists = _rebuild_sparse(db)
+        _store(db, lists)
+        return len(lists)
+    count = 0
+    last_id = db.execute(select(func.max(blogs.c.id))).scalar() or 0
+    for start in range(0, last_id, BATCH_SIZE):
+        ids = [blog_id for blog_id, in db.execute(
+            select(blogs.c.id).where(blogs.c.id > start, blogs.c.id <= start + BATCH_SIZE)
+        )]
+        _store(db, neighbours(db, ids))
+        count += len(ids)
+    return count
+
+
+def related_ids(db, blog_id: int, limit: int = RELATED_TOP_K) -> list:
+    return list(db.execute(
+        select(related.c.related_id).where(related.c.blog_id == blog_id).order_by(related.c.rank).limit(limit)
+    ).scalars())
+
+
+SEEDS = 20      # recent views, favourites and likes a recommendation starts from
+
+
+def known_ids(user_id: int):
+    # the user's own blogs and the ones they viewed, favourited or liked:
+    # nothing to recommend to them
+    return union(
+        select(blogs.c.id).where(blogs.c.author_id == user_id),
+        select(history.c.blog_id).where(history.c.user_id == user_id),
+        select(favourites.c.blog_id).where(favourites.c.user_id == user_id),
+        select(likes.c.blog_id).where(likes.c.reactor_id == user_id),
+    )
+
+
+def recommended_ids(db, user_id: int, limit: int = 10) -> list:
+    # blogs related to what the user recently viewed, favourited or liked,
+    # most related first, leaving out their own and the ones they know
+    recent = [
+        select(table.c.blog_id).where(user_column == user_id).order_by(time_column.desc()).limit(SEEDS).subquery()
+        for table, user_column, time_column in (
+            (history, history.c.user_id, history.c.viewed_at),
+            (favourites, favourites.c.user_id, favourites.c.added_at),
+            (likes, likes.c.reactor_id, likes.c.time_liked),
+        )
+    ]
+    seeds = union(*[select(subquery.c.blog_id) for subquery in recent]).subquery()
+    known = known_ids(user_id).subquery()
+    total = func.sum(related.c.score)
+    return list(db.execute(
+        select(related.c.related_id)
+        .where(
+            related.c.blog_id.in_(select(seeds.c.blog_id)),
+            related.c.related_id.not_in(select(known.c.id)),
+            related.c.related_id.in_(select(blogs.c.id)),
+        )
+        .group_by(related.c.related_id)
+        .order_by(total.desc(), related.c.related_id)
+        .limit(limit)
+    ).scalars())
+
+
+related_updater = DirtyUpdater("related-updater", update, RELATED_INTERVAL)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="related blogs index")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.parse_args()
+
+    with SessionLocal() as db:
+        count = rebuild(db)
+        db.commit()
+        print(f"{related.name} rebuilt: {count} blogs ({'scipy' if sparse is not None else 'pure Python'})")
@@ -0,0 +1,41 @@
+'''
+JSON response helpers.
+
+`JSONResponse` is FastAPI's orjson-backed response class when orjson is
+installed (optional, `pip install orjson`) and the standard one otherwise;
+main.py makes it the default for every route.
+
+`dump_json` validates ORM objects or rows against a response model and
+serializes them in one pass in pydantic-core, without the intermediate
+dicts of jsonable_encoder. The async routers and the response cache use it.
+'''
+from fastapi.responses import Response
+from pydantic import TypeAdapter
+
+try:
+    import orjson
+except ImportError:     # optional
+    orjson = None
+
+if orjson is not None:
+    from fastapi.responses import ORJSONResponse as JSONResponse
+else:
+    from fastapi.responses import JSONResponse
+
+_adapters = {}      # response model -> TypeAdapter
+
+
+def adapter_for(response_model) -> TypeAdapter:
+    adapter = _adapters.get(response_model)
+    if adapter is None:
+        adapter = _adapters[response_model] = TypeAdapter(response_model)
+    return adapter
+
+
+def dump_json(response_model, data) -> bytes:
+    adapter = adapter_for(response_model)
+    return adapter.dump_json(adapter.validate_python(data, from_attributes=True))
+
+
+def model_response(response_model, data, status_code: int = 200) -> Response:
+    return Response(dump_json(response_model, data), status_code=status_code, media_type="application/json")
@@ -0,0 +1,113 @@
+'''
+Async mirrors of the sync routers (ASYNC_DB=1).
+
+Each route keeps its path, response model and handler. The handler runs on
+the request's AsyncSession through `run_sync`, so the database round trips
+are awaited on the event loop instead of holding a threadpool worker.
+The response is validated and serialized to JSON bytes (responses.dump_json)
+inside the same call because lazy loads are only possible while the session
+is running the handler.
+'''
+import inspect
+
+from fastapi import APIRouter, Depends
+from fastapi.encoders import jsonable_encoder
+from fastapi.params import Depends as DependsParam
+from fastapi.responses import Response
+from fastapi.routing import APIRoute
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import get_async_db, get_async_read_db, get_db, get_read_db
+from jwt_token import get_current_user, get_current_user_async
+from responses import JSONResponse, dump_json
+
+# sync dependency -> async replacement
+ASYNC_DEPENDENCIES = {
+    get_db: get_async_db,
+    get_read_db: get_async_read_db,
+    get_current_user: get_current_user_async,
+}
+SESSION_DEPENDENCIES = {get_async_db, get_async_read_db}
+
+
+def _async_signature(endpoint):
+    params = []
+    session_params = []
+    for param in inspect.signature(endpoint).parameters.values():
+        default = param.default
+        if isinstance(default, DependsParam) and default.dependency in ASYNC_DEPENDENCIES:
+            dependency = ASYNC_DEPENDENCIES[default.dependency]
+            if dependency in SESSION_DEPENDENCIES:
+                session_params.append(param.name)
+                param = param.replace(annotation=AsyncSession)
+            param = param.replace(default=Depends(dependency))
+        params.append(param)
+    return inspect.Signature(params), session_params
+
+
+def _asyncify(route: APIRoute):
+    endpoint = route.endpoint
+    signature, session_params = _async_signature(endpoint)
+    status_code = route.status_code or 200
+
+    async def run(**kwargs):
+        sessions = [kwargs[name] for name in session_params]
+
+        def call(_):
+            for name in session_params:
+                kwargs[name] = kwargs[name].sync_session
+            result = endpoint(**kwargs)
+            if isinstance(result, Response):
+                return result
+            if route.response_model is not None:
+                return dump_json(route.response_model, result)
+            return jsonable_encoder(result)
+
+        # the Response a handler can ask for to set headers (e.g. X-Next-Cursor)
+        sub_responses = [value for value in kwargs.values() if isinstance(value, Response)]
+
+        result = await sessions[0].run_sync(call)
+        if isinstance(result, Response):
+            return result
+        if isinstance(result, bytes):
+            response = Response(result, status_code=status_code, media_type="application/json")
+        else:
+            response = JSONResponse(result, status_code=status_code)
+        for sub_response in sub_responses:
+            response.headers.update({
+                name: value for name, value in sub_response.headers.items() if name != "content-length"
+            })
+        return response
+
+    run.__signature__ = signature
+    run.__name__ = endpoint.__name__
+    run.__doc__ = endpoint.__doc__
+    return run
+
+
+def async_router(router: APIRouter) -> APIRouter:
+    mirror = APIRouter()
+
+    for route in router.routes:
+        if not isinstance(route, APIRoute):
+            mirror.routes.append(route)
+            continue
+
+        endpoint = route.endpoint
+        if not inspect.iscoroutinefunction(endpoint) and _async_signature(endpoint)[1]:
+            endpoint = _asyncify(route)
+
+        mirror.add_api_route(
+            route.path,
+            endpoint,
+            response_model=route.response_model,
+            status_code=route.status_code,
+            tags=route.tags,
+            methods=route.methods,
+            name=route.name,
+            summary=route.summary,
+            description=route.description,
+            response_class=route.response_class,
+        )
+
+    return mirror
@@ -1,8 +1,9 @@
 from fastapi import Depends, APIRouter, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from passlib.context import CryptContext
 from jwt_token import  getToken
+from passwords import hash_password, verify_password
 from schemas import user, token
 from database import get_db
 import models
@@ -11,51 +12,53 @@ import models
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# register/login are async so the bcrypt work can be awaited on the hashing
+# pool (passwords.py); the short database calls go to the threadpool
 
-def hash_pass(password: str):
-    return pwd_context.hash(password)
 
-def verify_pass(plain_pass, hash_pass):
-    return pwd_context.verify(plain_pass, hash_pass)
+def add_user(db: Session, user: models.User):
+    db.add(user)
+    db.commit()
+    db.refresh(user)
 
-## worked
-# import bcrypt
-# def verify_pass(plain_password: str, hashed_password: str) -> bool:
-#     return bcrypt.checkpw(plain_password.encode("utf-8"), hashed_password.encode("utf-8"))
 
-# def hash_pass(password: str) -> str:
-#     return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+def find_user(db: Session, username: str):
+    return db.query(models.User).filter(models.User.username == username).first()
 
 
+def update_password(db: Session, user: models.User, hashed: str):
+    user.password = hashed
+    db.commit()
+
 
 @router.post("/create", status_code=status.HTTP_200_OK)
-def register(request: user.UserIn, db: Session = Depends(get_db)):
+async def register(request: user.UserIn, db: Session = Depends(get_db)):
     user = models.User(
         username=request.username,
         email=request.email,
-        password=hash_pass(request.password),
+        password=await hash_password(request.password),
     )
 
-    db.add(user)
-    db.commit()
-    db.refresh(user)
+    await run_in_threadpool(add_user, db, user)
 
     return {"info": "user created successfully"}
 
 @router.post('/login', response_model=token.Token)
-def login(request: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = (
-        db.query(models.User).filter(models.User.username == request.username).first()
-    )
+async def login(request: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    user = await run_in_threadpool(find_user, db, request.username)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
         )
-    if not verify_pass(request.password, user.password):
+
+    valid, new_hash = await verify_password(request.password, user.password)
+    if not valid:
         raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect password"
         )
+    if new_hash:
+        # hashed with outdated settings (e.g. fewer rounds), upgrade it transparently
+        await run_in_threadpool(update_password, db, user, new_hash)
 
     access_token = getToken(user.username)
     return {
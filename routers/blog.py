@@ -1,16 +1,30 @@
+import time
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlalchemy.orm import Session, joinedload
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
 from sqlalchemy import func
 
-from schemas.blog import BlogIn, BlogOut, BlogInDB
+from schemas.blog import BlogIn, BlogImport, BlogOut, BlogInDB
 from schemas.comment import CommentOut
 from schemas.like import Like
-from schemas.category import Category
-from schemas.tag import Tag
-from database import get_db
+from cache import response_cache
+from config import RELATED_TOP_K
+from database import get_db, get_read_db
 import models
 from jwt_token import get_current_user
+from pagination import CursorQuery, LimitQuery, paginate, set_next_cursor
+import bulk
+import feed
+from jobs import runner
+import related
+import search
+from streaming import StreamQuery, stream_query, wants_stream
+import taxonomy
+import trending
+from views import view_buffer
 
 router = APIRouter(
     prefix='/blog',
@@ -25,77 +39,99 @@ def create_blog(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)):
 
-    category = db.query(models.Category).filter(models.Category.name == request.category_name).first()
-    if not category:
-        category = models.Category(name=request.category_name)
-        db.add(category)
-        db.flush()
-
-    tag_objects = []
-    if request.tags:
-        for tag_name__ in request.tags:
-            tag_name = tag_name__.strip().lower()
-            if len(tag_name) == 0:
-                continue
-            tag_exist = db.query(models.Tag).filter(models.Tag.name == tag_name).first()
-            if not tag_exist:
-                tag = models.Tag(name=tag_name)
-                db.add(tag)
-                db.flush()
-            else:
-                tag = tag_exist
-            if tag not in tag_objects:
-                tag_objects.append(tag)
-    
+    # a constant number of round trips whatever the number of tags (taxonomy.py)
+    tag_ids = taxonomy.resolve_tags(db, taxonomy.normalize_tags(request.tags))
+
     blog = models.Blog(
         title=request.title,
         body=request.body,
         author_id=current_user.id,
-        category_id = category.id,
-        tags=tag_objects,
+        category_id=taxonomy.resolve_category(db, request.category_name),
     )
     
     db.add(blog)
+    db.flush()
+    if tag_ids:
+        db.execute(models.blog_tag.insert(), [{"blog_id": blog.id, "tag_id": tag_id} for tag_id in tag_ids.values()])
+    search.index_blogs(db, [blog.id])
+    feed.index_blogs(db, [blog.id])
+    trending.update(db, [blog.id])
     db.commit()
+    response_cache.invalidate("blogs")
+    related.related_updater.mark(blog.id)
 
     return {"info": "Blog created successfully"}
 
 
+@router.post('/bulk', status_code=status.HTTP_200_OK)
+async def import_blogs(
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)):
+    # NDJSON body, one BlogImport per line; committed every bulk.IMPORT_CHUNK_SIZE
+    # lines, so a failure part way keeps the chunks already imported
+    started = time.perf_counter()
+    imported = failed = 0
+    errors = []
+    chunk = []
+
+    line_number = 0
+    async for line in bulk.iter_lines(request.stream()):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            chunk.append(BlogImport.model_validate_json(line))
+        except ValidationError as e:
+            failed += 1
+            if len(errors) < bulk.IMPORT_MAX_ERRORS:
+                errors.append({"line": line_number, "detail": e.errors(include_url=False, include_input=False)})
+            continue
+        if len(chunk) >= bulk.IMPORT_CHUNK_SIZE:
+            imported += await run_in_threadpool(bulk.import_chunk, db, current_user.id, chunk)
+            chunk = []
+    imported += await run_in_threadpool(bulk.import_chunk, db, current_user.id, chunk)
+
+    seconds = time.perf_counter() - started
+    return {
+        "imported": imported,
+        "failed": failed,
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(imported / seconds) if seconds else imported,
+    }
+
+
+@router.get('/export')
+async def export_blogs(current_user: models.User = Depends(get_current_user)):
+    # every blog as NDJSON (BlogOut per line), read from a server-side cursor
+    return StreamingResponse(bulk.export_lines(), media_type="application/x-ndjson")
+
+
 @router.get('/get', response_model=BlogOut)
-def get_blog(id: int = Query(...), db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    blog = db.query(models.Blog).filter(models.Blog.id == id).first()
+def get_blog(id: int = Query(...), db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
+    blog = db.query(models.Blog).options(*models.blog_out_options).filter(models.Blog.id == id).first()
 
     if not blog:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="blog not found")
 
-    blog.view_count += 1
-    history = db.query(models.History).filter(
-        models.History.user_id == current_user.id,
-        models.History.blog_id == blog.id,
-    ).first()
-
-    if history:
-        history.viewed_at = func.now()
-    else:
-        history = models.History(
-            user_id = current_user.id,
-            blog_id = id
-        )
-        db.add(history)
-        db.flush()
-
-    
-    db.commit()
-    db.refresh(blog)
+    # view_count and history are written in batches by views.view_buffer
+    view_buffer.record(current_user.id, blog.id)
 
     return blog
 
 
 @router.get('/all', response_model=List[BlogOut])
-def get_all_blogs(skip: int = 0, limit: int = 10 ,db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def get_all_blogs(request: Request, response: Response, cursor: Optional[str] = CursorQuery, limit: int = LimitQuery,
+                db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
     # if not admin: raise exception
-    blogs = db.query(models.Blog).offset(skip).limit(limit).all()
-    return blogs
+    def page():
+        query = db.query(models.Blog).options(*models.blog_out_options)
+        blogs, next_cursor = paginate(query, [models.Blog.time_created, models.Blog.id], cursor, limit)
+        set_next_cursor(response, next_cursor)
+        return blogs
+
+    return response_cache.serve(request, response, ["blogs"], List[BlogOut], page)
 
 
 @router.put('/{id}/update', status_code=status.HTTP_200_OK)
@@ -114,7 +150,10 @@ def update_blog(id: int, request: BlogInDB, db: Session = Depends(get_db), curre
         blog.body = request.body
         blog.time_updated = func.now()
 
+    db.flush()
+    search.index_blogs(db, [blog.id])
     db.commit()
+    response_cache.invalidate("blogs", f"blog:{id}")
     db.refresh(blog)
     return {'info': 'updated succesfully'}
 
@@ -128,78 +167,120 @@ def delete_blog(id: int, db: Session = Depends(get_db), current_user: models.Use
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='you cannot delete this content')
     
     blog.delete(synchronize_session=False)
+    # nothing cascades on SQLite; these rows are also related.py's features
+    for table in (models.Like.__table__, models.favourite_blog_table, models.History.__table__):
+        db.execute(table.delete().where(table.c.blog_id == id))
+    search.remove_blogs(db, [id])
+    feed.remove_blogs(db, [id])
+    trending.remove_blogs(db, [id])
+    related.remove_blogs(db, [id])
     db.commit()
+    response_cache.invalidate("blogs", f"blog:{id}")
+    # the tags it leaves unused go later, batched with other deletes
+    runner.submit_batch("tag-cleanup", taxonomy.remove_blog_tags, id)
     return {'info': 'deleted'}
 
 
 # Search/filter operations
 @router.get('/query', response_model=List[BlogOut])
-def blog_query(category: Optional[str] = Query(None), tag: Optional[str] = Query(None),
-                skip: int = 0, limit: int = 10,
-                db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    query = db.query(models.Blog) 
-    if category:
-        query = query.join(models.Category).filter(models.Category.name == category).options(
-            joinedload(models.Blog.category),
-            joinedload(models.Blog.tags),
-        )
-
-    if tag:
-        query = query.join(models.Blog.tags).filter(models.Tag.name == tag).options(
-            joinedload(models.Blog.category),
-            joinedload(models.Blog.tags),
-        )
-
-    return query.order_by(models.Blog.time_created.desc()).all()
+def blog_query(request: Request, response: Response, category: Optional[str] = Query(None), tag: Optional[str] = Query(None),
+                cursor: Optional[str] = CursorQuery, limit: int = LimitQuery,
+                db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
+    # a page of ids from the blog_feed read model (feed.py), then the blogs
+    def page():
+        category_id = taxonomy.find_category(db, category) if category else 0
+        tag_id = taxonomy.find_tag(db, tag) if tag else 0
+        if category_id is None or tag_id is None:
+            return []
+
+        ids, next_cursor = feed.page(db, category_id, tag_id, cursor, limit)
+        set_next_cursor(response, next_cursor)
+        blogs = {blog.id: blog for blog in db.query(models.Blog).options(*models.blog_out_options).filter(models.Blog.id.in_(ids))}
+        return [blogs[blog_id] for blog_id in ids if blog_id in blogs]
+
+    return response_cache.serve(request, response, ["blogs"], List[BlogOut], page)
+
+@router.get('/trending', response_model=List[BlogOut])
+def trending_blogs(request: Request, response: Response, cursor: Optional[str] = CursorQuery, limit: int = LimitQuery,
+                   db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
+    # highest trending score first, from the blog_trending read model (trending.py)
+    def page():
+        ids, next_cursor = trending.page(db, cursor, limit)
+        set_next_cursor(response, next_cursor)
+        blogs = {blog.id: blog for blog in db.query(models.Blog).options(*models.blog_out_options).filter(models.Blog.id.in_(ids))}
+        return [blogs[blog_id] for blog_id in ids if blog_id in blogs]
+
+    return response_cache.serve(request, response, ["blogs", "trending"], List[BlogOut], page)
 
 @router.get('/search', response_model=List[BlogOut])
-def search_blog(search_query: str, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def search_blog(search_query: str, response: Response, cursor: Optional[str] = CursorQuery, limit: int = LimitQuery,
+                db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
     if search_query.__len__() < 2:
         raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail='query is too short!!!')
 
-    blog = db.query(models.Blog).join(models.Category).join(models.Tag).group_by(
-        models.Blog.id, Category.name).filter(
-            func.to_tsvector(
-                'english',
-                func.coalesce(models.Blog.title, '') + ' ' +
-                func.coalesce(models.Blog.body, '') + ' ' +
-                func.coalesce(models.Category.name, '') + ' ' + 
-                func.coalesce(
-                    func.aggregate_strings(Tag.name, ' '), ''
-                )
-            ).match(search_query)
-        ).all()
-           
-
-    # blogs = db.query(models.Blog).filter(                     ## postgresql
-    #         models.Blog.search_vector.match(search_query)
-    #     ).all()
-    
-
-    return blog
+    # BM25 ranked, over title, body, category and tag names (search.py)
+    blogs, next_cursor = search.search(db, search_query, cursor, limit)
+    set_next_cursor(response, next_cursor)
+    return blogs
 
 # Relationship endpoints
 @router.get('/{id}/comments', response_model=List[CommentOut])
-def get_comments(id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    if not db.query(db.query(models.Blog).filter(models.Blog.id == id).exists()).scalar():
-        raise HTTPException(status_code=404, detail="Blog not found")
+def get_comments(id: int, request: Request, response: Response, stream: bool = StreamQuery,
+                db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
+    comments_query = db.query(*models.columns(models.Comment, CommentOut)).filter(models.Comment.blog_id == id)
+    if wants_stream(request, stream):
+        if not db.query(db.query(models.Blog).filter(models.Blog.id == id).exists()).scalar():
+            raise HTTPException(status_code=404, detail="Blog not found")
+        return stream_query(comments_query.order_by(models.Comment.id), CommentOut)
+
+    def comments():
+        if not db.query(db.query(models.Blog).filter(models.Blog.id == id).exists()).scalar():
+            raise HTTPException(status_code=404, detail="Blog not found")
 
-    return db.query(models.Comment).filter(models.Comment.blog_id == id).all()
+        return comments_query.all()
+
+    return response_cache.serve(request, response, [f"blog:{id}"], List[CommentOut], comments)
 
 @router.get('/{id}/likes', response_model=List[Like])
-def get_likes(id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def get_likes(id: int, request: Request, response: Response, stream: bool = StreamQuery,
+                db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
+    likes_query = db.query(*models.columns(models.Like, Like)).filter(models.Like.blog_id == id)
+    if wants_stream(request, stream):
+        if not db.query(db.query(models.Blog).filter(models.Blog.id == id).exists()).scalar():
+            raise HTTPException(status_code=404, detail="Blog not found")
+        return stream_query(likes_query.order_by(models.Like.id), Like)
+
+    def likes():
+        if not db.query(models.Blog).filter(models.Blog.id == id).first():
+            raise HTTPException(status_code=404, detail="Blog not found")
+
+        return likes_query.all()
 
-    if not db.query(models.Blog).filter(models.Blog.id == id).first():
-        raise HTTPException(status_code=404, detail="Blog not found")
+    return response_cache.serve(request, response, [f"blog:{id}"], List[Like], likes)
 
-    return db.query(models.Like).filter(models.Like.blog_id == id).all()
+
+@router.get('/{id}/related', response_model=List[BlogOut])
+def get_related(id: int, request: Request, response: Response, limit: int = Query(10, ge=1, le=RELATED_TOP_K),
+                db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
+    # the precomputed neighbour list of the blog_related read model (related.py)
+    def related_blogs():
+        ids = related.related_ids(db, id, limit)
+        if not ids and not db.query(db.query(models.Blog).filter(models.Blog.id == id).exists()).scalar():
+            raise HTTPException(status_code=404, detail="Blog not found")
+        blogs = {blog.id: blog for blog in db.query(models.Blog).options(*models.blog_out_options).filter(models.Blog.id.in_(ids))}
+        return [blogs[blog_id] for blog_id in ids if blog_id in blogs]
+
+    return response_cache.serve(request, response, ["blogs", f"blog:{id}"], List[BlogOut], related_blogs)
 
 
 @router.get('/{id}/tags', response_model=List[str])
-def get_tags(id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    blog = db.query(models.Blog).filter(models.Blog.id == id).first()
+def get_tags(id: int, request: Request, response: Response, db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
+    def tags():
+        blog = db.query(models.Blog).filter(models.Blog.id == id).first()
 
-    if not blog:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="blog not found")
-    
-    return [tag.name for tag in blog.tags]
+        if not blog:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="blog not found")
+        
+        return [tag.name for tag in blog.tags]
+
+    return response_cache.serve(request, response, [f"blog:{id}", "tags"], List[str], tags)
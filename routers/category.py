@@ -3,8 +3,12 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 
 from schemas.category import Category
+from cache import response_cache
 from database import get_db
+import feed
 import models
+import search
+import taxonomy
 from jwt_token import get_current_user
 
 router = APIRouter(
@@ -24,6 +28,7 @@ def create_category(request: Category ,db: Session = Depends(get_db), current_us
     db.add(category)
     db.commit()
     db.refresh(category)
+    taxonomy.remember_category(category.name, category.id)
 
     return {'info': 'created'}
 
@@ -34,6 +39,15 @@ def delete_category(id: int, db: Session = Depends(get_db), current_user: models
     if not category.first():
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="category not found")
     
+    name = category.first().name
+    blog_ids = [blog.id for blog in category.first().blogs]
+    db.query(models.Blog).filter(models.Blog.category_id == id).update(
+        {models.Blog.category_id: None}, synchronize_session=False
+    )
     category.delete(synchronize_session=False)
+    search.index_blogs(db, blog_ids)
+    feed.remove_category(db, id)
     db.commit()
+    taxonomy.forget_categories([name])
+    response_cache.invalidate("blogs")
     return {'info': 'deleted'}
@@ -1,8 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
+from cache import response_cache
 from database import get_db
 from jwt_token import get_current_user
 import models
+import counters
 from schemas.comment import CommentIn, CommentInDB
 from schemas.blog import BlogOut
 
@@ -22,10 +24,11 @@ def add_comment(blog_id: int, request: CommentIn, db: Session = Depends(get_db),
     comment.blog_id = blog_id
     comment.commenter_id = current_user.id
     comment.body = request.body
-    blog.comments_count += 1
 
     db.add(comment)
+    counters.bump(db, blog_id, comments_count=1)
     db.commit()
+    response_cache.invalidate("blogs", f"blog:{blog_id}")
     db.refresh(comment)
 
     return {'info': 'comment added'}
@@ -34,7 +37,9 @@ def add_comment(blog_id: int, request: CommentIn, db: Session = Depends(get_db),
 @router.get('/{id}/blog', response_model=BlogOut)
 def get_blog(id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
     comment = db.query(models.Comment).filter(models.Comment.id == id).first()
-    blog = db.query(models.Blog).filter(models.Blog.id == comment.blog_id).first()
+    blog = None
+    if comment:
+        blog = db.query(models.Blog).options(*models.blog_out_options).filter(models.Blog.id == comment.blog_id).first()
 
     if (not comment) or (not blog):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='nothing found')
@@ -54,24 +59,24 @@ def update_comment(id: int, request: CommentInDB, db: Session = Depends(get_db),
     comment.body = request.body
 
     db.commit()
+    response_cache.invalidate(f"blog:{comment.blog_id}")
     db.refresh(comment)
 
     return {'info': 'updated'}
 
 @router.delete('/{id}/delete')
 def delete_comment(id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    comment = db.query(models.Comment).filter(models.Comment.id == id)
-    blog = db.query(models.Blog).filter(models.Blog.id == comment.blog_id).first()
+    comment = db.query(models.Comment).filter(models.Comment.id == id).first()
 
-    if not comment.first():
+    if not comment:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="no comment found")
-    if comment.first().commenter_id != current_user.id:
+    if comment.commenter_id != current_user.id:
         raise HTTPException(status_code=status.HTTP_203_NON_AUTHORITATIVE_INFORMATION, detail='You cannot perform this action')
-    if not blog:
-        raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, detail='cannot perform this action')
-    
-    blog.comments_count -= 1    
-    comment.delete(synchronize_session=False)
+
+    blog_id = comment.blog_id
+    db.delete(comment)
+    counters.bump(db, blog_id, comments_count=-1)
     db.commit()
+    response_cache.invalidate("blogs", f"blog:{blog_id}")
 
     return {'info': 'deleted'}
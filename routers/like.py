@@ -1,8 +1,13 @@
-from fastapi import APIRouter, Depends, status, HTTPException
+from typing import List
+from fastapi import APIRouter, Depends, status, HTTPException, Query
+from sqlalchemy import literal, select
 from sqlalchemy.orm import Session
 from jwt_token import get_current_user
-from database import get_db
+from cache import response_cache
+from database import dialect_insert, get_db, get_read_db
 import models
+import counters
+from related import related_updater
 
 
 router = APIRouter(
@@ -10,47 +15,55 @@ router = APIRouter(
     tags=['likes']
 )
 
-@router.post('/{blog_id}/like')
-def add_like(id: int, db: Session = Depends(get_db),  current_user: models.User = Depends(get_current_user)):
-    blog = db.query(models.Blog).filter(models.Blog.id == id).first()
-
-    if not blog:
-        raise HTTPException(status_code=status.HTTP_204_NO_CONTENT, detail='blog not found')
+likes = models.Like.__table__
+blogs = models.Blog.__table__
 
-    like = db.query(models.Like).filter(models.Like.blog_id == blog.id).first()
+# Liking and unliking are idempotent: (blog_id, reactor_id) is unique, the like
+# is inserted-or-ignored / deleted, and the counter moves by the number of rows
+# actually changed. The counter UPDATE ... RETURNING gives back the new count
+# and tells whether the blog exists, so each call is two statements.
 
-    if like:
-        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail='already liked')
-
-    like = models.Like()
-    like.blog_id = blog.id
-    like.reactor_id = current_user.id 
+@router.post('/{blog_id}/like')
+def add_like(blog_id: int, db: Session = Depends(get_db),  current_user: models.User = Depends(get_current_user)):
+    insert = dialect_insert(db)
+    inserted = db.execute(
+        insert(likes).from_select(
+            ["blog_id", "reactor_id"],
+            select(blogs.c.id, literal(current_user.id)).where(blogs.c.id == blog_id),
+        ).on_conflict_do_nothing()
+    ).rowcount
 
-    blog.likes_count += 1
+    counts = counters.bump(db, blog_id, likes_count=inserted)
+    if counts is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='blog not found')
 
-    db.add(like)
     db.commit()
-    db.refresh(like)
-    
-    return {'info': 'liked'}
+    if inserted:
+        response_cache.invalidate("blogs", f"blog:{blog_id}")
+        related_updater.mark(blog_id)
+
+    return {'info': 'liked', 'liked': True, 'likes_count': counts.likes_count}
 
 
 @router.delete('/{blog_id}/unlike')
-def unlike(id: int, db: Session = Depends(get_db),  current_user: models.User = Depends(get_current_user)):
-    blog = db.query(models.Blog).filter(models.Blog.id == id).first()
+def unlike(blog_id: int, db: Session = Depends(get_db),  current_user: models.User = Depends(get_current_user)):
+    deleted = db.execute(
+        likes.delete().where(likes.c.blog_id == blog_id, likes.c.reactor_id == current_user.id)
+    ).rowcount
+
+    counts = counters.bump(db, blog_id, likes_count=-deleted)
+    if counts is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='blog not found')
 
-    if not blog:
-        raise HTTPException(status_code=status.HTTP_204_NO_CONTENT, detail='blog not found')
+    db.commit()
+    if deleted:
+        response_cache.invalidate("blogs", f"blog:{blog_id}")
 
-    like = db.query(models.Like).filter(models.Like.blog_id == blog.id).first()
+    return {'info': 'unliked', 'liked': False, 'likes_count': counts.likes_count}
 
-    if not like:
-        raise HTTPException(status_code=status.HTTP_405_METHOD_NOT_ALLOWED, detail='already liked')
-    if like.reactor_id != current_user.id:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
 
-    db.delete(like)
-    db.commit()
-    blog.likes_count -= 1
-    
-    return {'info': 'unliked'}
\ No newline at end of file
+@router.get('/liked', response_model=List[int])
+def liked_blogs(blog_id: List[int] = Query(..., max_length=100), db: Session = Depends(get_read_db),
+                current_user: models.User = Depends(get_current_user)):
+    # which of the given blogs (?blog_id=1&blog_id=2...) the current user liked
+    return sorted(models.Like.liked_blog_ids(current_user.id, blog_id, db))
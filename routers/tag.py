@@ -1,8 +1,12 @@
 from fastapi import APIRouter, Depends, status, HTTPException
 from sqlalchemy.orm import Session
 from jwt_token import get_current_user
+from cache import response_cache
 from database import get_db
+import feed
 import models
+import search
+import taxonomy
 
 
 router = APIRouter(
@@ -25,6 +29,7 @@ def add_tag(tag_name: str, db: Session = Depends(get_db),  current_user: models.
     db.add(tag)
     db.commit()
     db.refresh(tag)
+    taxonomy.remember_tag(tag.name, tag.id)
     
     return {'info': 'tag added'}
 
@@ -32,12 +37,21 @@ def add_tag(tag_name: str, db: Session = Depends(get_db),  current_user: models.
 
 @router.delete('/delete')
 def delete_tag(tag_name: str, db: Session = Depends(get_db),  current_user: models.User = Depends(get_current_user)):
-    tag = db.query(models.Tag).filter(models.Tag.name == tag_name)
+    # stored, and cached, the way create_blog normalizes them
+    names = taxonomy.normalize_tags([tag_name])
+    tag = db.query(models.Tag).filter(models.Tag.name == (names[0] if names else ""))
 
-    if not tag.first():
+    if not names or not tag.first():
         raise HTTPException(status_code=status.HTTP_204_NO_CONTENT, detail='no tag found')
     
+    tag_id, tag_name = tag.first().id, tag.first().name
+    blog_ids = [blog.id for blog in tag.first().blogs]
+    db.execute(models.blog_tag.delete().where(models.blog_tag.c.tag_id == tag_id))
     tag.delete(synchronize_session=False)
+    search.index_blogs(db, blog_ids)
+    feed.remove_tag(db, tag_id)
     db.commit()
+    taxonomy.forget_tags([tag_name])
+    response_cache.invalidate("blogs", "tags")
 
     return {'info': 'deleted'}
\ No newline at end of file
@@ -1,22 +1,27 @@
-from typing import List
-from fastapi import APIRouter, Depends, status, HTTPException, Query
-from sqlalchemy import func
+from typing import List, Optional
+from fastapi import APIRouter, Depends, status, HTTPException, Query, Request, Response
 
 from schemas.history import HistoryOut
 from jwt_token import get_current_user
-from schemas.blog import BlogOut
+from schemas.blog import BlogOut, ViewerState
 from schemas.comment import CommentOut
 from schemas.like import Like
 from schemas.user import UserOut, UserInDB
-from database import get_db
-from sqlalchemy.orm import Session, joinedload
+from database import get_db, get_read_db, insert_ignore
+from pagination import CursorQuery, LimitQuery, keyset, paginate, set_next_cursor
+from streaming import StreamQuery, stream_query, wants_stream
+from sqlalchemy.orm import Session
 import models
-import random 
+import counters
+from history import clear_history
+import related
+import trending
+from views import view_buffer
 
 router = APIRouter(prefix="/user", tags=["user"])
 
 @router.get('/', response_model=UserOut)
-def get_user(id: int = Query(...), db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def get_user(id: int = Query(...), db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
     user = db.query(models.User).filter(models.User.id == id).first()
 
     if not user:
@@ -26,17 +31,20 @@ def get_user(id: int = Query(...), db: Session = Depends(get_db), current_user:
     return user
 
 @router.get('/all', response_model=List[UserOut])
-def get_users(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def get_users(request: Request, stream: bool = StreamQuery,
+            db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
     # if not admin: raise exception
-    users = db.query(models.User).all()
-    return users
+    users = db.query(*models.columns(models.User, UserOut)).order_by(models.User.id)
+    if wants_stream(request, stream):
+        return stream_query(users, UserOut)
+    return users.all()
 
 
 @router.put("/{id}/update", status_code=status.HTTP_200_OK)
 def update_user(id: int,request: UserInDB, db: Session = Depends(get_db),  current_user: models.User = Depends(get_current_user)):
     user = db.query(models.User).filter(models.User.id == id).first()
 
-    if id is not current_user.id:       # or not admin
+    if id != current_user.id:       # or not admin
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='You cannot perform this action')
     
     if not user:
@@ -59,7 +67,7 @@ def update_user(id: int,request: UserInDB, db: Session = Depends(get_db),  curre
     return {"info": "User updated successfully!"}
 
 
-@router.delete("/{id}/delete", status_code=status.HTTP_200_OK)
+@router.delete("/{id:int}/delete", status_code=status.HTTP_200_OK)
 def delete_user(id: int, db: Session = Depends(get_db),  current_user: models.User = Depends(get_current_user)):
     user = db.query(models.User).filter(models.User.id == id).first()
 
@@ -77,39 +85,92 @@ def delete_user(id: int, db: Session = Depends(get_db),  current_user: models.Us
 
 
 @router.get('/my-likes', response_model=List[Like] ,status_code=status.HTTP_200_OK)
-def my_likes(db: Session = Depends(get_db),  current_user: models.User = Depends(get_current_user)):
-    likes = db.query(models.Like).filter(models.Like.reactor_id == current_user.id)
+def my_likes(request: Request, response: Response, cursor: Optional[str] = CursorQuery, limit: int = LimitQuery,
+            stream: bool = StreamQuery,
+            db: Session = Depends(get_read_db),  current_user: models.User = Depends(get_current_user)):
+    likes = db.query(models.Like.id, *models.columns(models.Like, Like)).filter(models.Like.reactor_id == current_user.id)
+
+    if wants_stream(request, stream):
+        return stream_query(keyset(likes, [models.Like.time_liked, models.Like.id], cursor), Like)
 
-    return likes.all()
+    likes, next_cursor = paginate(likes, [models.Like.time_liked, models.Like.id], cursor, limit)
+    set_next_cursor(response, next_cursor)
+    return likes
 
 @router.get('/my-comments', response_model=List[CommentOut] ,status_code=status.HTTP_200_OK)
-def my_comments(db: Session = Depends(get_db),  current_user: models.User = Depends(get_current_user)):
-    comments = db.query(models.Comment).filter(models.Comment.commenter_id == current_user.id)
+def my_comments(request: Request, response: Response, cursor: Optional[str] = CursorQuery, limit: int = LimitQuery,
+            stream: bool = StreamQuery,
+            db: Session = Depends(get_read_db),  current_user: models.User = Depends(get_current_user)):
+    comments = db.query(*models.columns(models.Comment, CommentOut)).filter(models.Comment.commenter_id == current_user.id)
 
-    return comments.all()  
+    if wants_stream(request, stream):
+        return stream_query(keyset(comments, [models.Comment.time_commented, models.Comment.id], cursor), CommentOut)
+
+    comments, next_cursor = paginate(comments, [models.Comment.time_commented, models.Comment.id], cursor, limit)
+    set_next_cursor(response, next_cursor)
+    return comments
 
 @router.get('/my-blogs', response_model=List[BlogOut])
-def my_blogs(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def my_blogs(request: Request, response: Response, cursor: Optional[str] = CursorQuery, limit: int = LimitQuery,
+            stream: bool = StreamQuery,
+            db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
     blogs = db.query(models.Blog).filter(models.Blog.author_id == current_user.id).options(
-        joinedload(models.Blog.category),               ## category name and tag names are not included
-        joinedload(models.Blog.tags),                   ## in the Blog model so 2 extra query will be called
-    )                                                   ## joinedload stop extra query.
+        *models.blog_out_options,                       ## category name and tag names are not included
+    )                                                   ## in the Blog model, load them for the whole page
 
-    return blogs.all()
+    if wants_stream(request, stream):
+        return stream_query(keyset(blogs, [models.Blog.time_created, models.Blog.id], cursor), BlogOut)
 
+    blogs, next_cursor = paginate(blogs, [models.Blog.time_created, models.Blog.id], cursor, limit)
+    set_next_cursor(response, next_cursor)
+    return blogs
 
-@router.get('/my-favorites', response_model=List[BlogOut])
-def get_favorite_blogs(skip: int = 0, limit: int = 10 ,db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
 
-    favorites = db.query(models.Blog).join(
-        models.favorite_blog_table,
-        models.Blog.id == models.favorite_blog_table.c.blog_id,
-    ).filter(models.favourite_blog_table.c.user_id == current_user.id).options(
-            joinedload(models.Blog.category),
-            joinedload(models.Blog.tags),
-    ).order_by(models.Blog.time_created.desc()).offset(skip).limit(limit).all()
-
-    return favorites
+@router.get('/my-favorites', response_model=List[BlogOut])
+def get_favorite_blogs(response: Response, cursor: Optional[str] = CursorQuery, limit: int = LimitQuery,
+            db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
+    # most recently favorited first
+    favorites = models.favourite_blog_table.c
+    query = db.query(models.Blog, favorites.added_at, favorites.blog_id).join(
+        models.favourite_blog_table,
+        models.Blog.id == favorites.blog_id,
+    ).filter(favorites.user_id == current_user.id).options(*models.blog_out_options)
+
+    rows, next_cursor = paginate(query, [favorites.added_at, favorites.blog_id], cursor, limit,
+                                 key=lambda row: [row.added_at, row.blog_id])
+    set_next_cursor(response, next_cursor)
+    return [row.Blog for row in rows]
+
+
+@router.get('/recommended', response_model=List[BlogOut])
+def recommended(limit: int = LimitQuery, db: Session = Depends(get_read_db),
+                current_user: models.User = Depends(get_current_user)):
+    # summed related-blog scores of what the user recently viewed, favourited
+    # or liked (related.py); trending blogs for users with no activity yet.
+    # Neither includes the user's own blogs or the ones they already know.
+    ids = related.recommended_ids(db, current_user.id, limit)
+    if not ids:
+        ids, _ = trending.page(db, None, limit, exclude=related.known_ids(current_user.id))
+    blogs = {blog.id: blog for blog in db.query(models.Blog).options(*models.blog_out_options).filter(models.Blog.id.in_(ids))}
+    return [blogs[blog_id] for blog_id in ids if blog_id in blogs]
+
+
+@router.get('/viewer-state', response_model=List[ViewerState])
+def viewer_state(blog_id: List[int] = Query(..., max_length=100),
+            db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
+    # liked / favorited / last viewed for a page of blogs (?blog_id=1&blog_id=2...),
+    # three set-based queries whatever the page size
+    blog_ids = list(dict.fromkeys(blog_id))
+    liked = models.Like.liked_blog_ids(current_user.id, blog_ids, db)
+    favorited = models.Blog.favorited_blog_ids(current_user.id, blog_ids, db)
+    viewed = models.History.last_viewed(current_user.id, blog_ids, db)
+    for id, viewed_at in view_buffer.pending(current_user.id, blog_ids).items():     # not flushed yet
+        viewed[id] = max(viewed_at, viewed.get(id, viewed_at))
+
+    return [
+        {"blog_id": id, "liked": id in liked, "favorited": id in favorited, "viewed_at": viewed.get(id)}
+        for id in blog_ids
+    ]
 
 
 @router.post('/favorite/add/{id}', status_code=status.HTTP_200_OK)
@@ -119,13 +180,14 @@ def add_to_favorite_blog(id: int, db: Session = Depends(get_db), current_user: m
     if not blog:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="blog not found!!!")
     
-    if blog.is_favorited(current_user.id, blog.id, db):
+    added = insert_ignore(db, models.favourite_blog_table, {"user_id": current_user.id, "blog_id": blog.id})
+    if not added:
         raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail='Already exist!!!')
     
-    current_user.favourite_blogs.append(blog)
-    blog.favourite_count += 1
-
     db.commit()
+    # nothing in the response depends on the counter: batched in the background
+    counters.bump_later(blog.id, favourite_count=1)
+    related.related_updater.mark(blog.id)
 
     return {'info': 'blog added to favorite!!'}
 
@@ -133,64 +195,47 @@ def add_to_favorite_blog(id: int, db: Session = Depends(get_db), current_user: m
 
 @router.delete('/favorite/remove/{id}', status_code=status.HTTP_200_OK)
 def remove_from_favorite_blog(id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    if not models.Blog.is_favorited(current_user.id, id, db):
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Blog not found in favorites!!!')
-
-    blog = db.query(models.Blog).filter(models.Blog.id == id).first()
-    if not blog:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Blog not found"
-        )
-
-    db.execute(
+    removed = db.execute(
         models.favourite_blog_table.delete().where(
             models.favourite_blog_table.c.user_id == current_user.id,
             models.favourite_blog_table.c.blog_id == id,
         )
-    )
+    ).rowcount
 
-    blog.favourite_count -= 1
+    if not removed:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Blog not found in favorites!!!')
 
     db.commit()
-    db.refresh(blog)
-
-    if random.random() < 0.01:  # verify fovorite_count ( 1% chance )
-        actual_count = (
-            db.query(func.count(models.favorite_blog_table.c.blog_id))
-            .filter(models.favorite_blog_table.c.blog_id == id)
-            .scalar()
-        )
-
-        if blog.favourite_count != actual_count:
-            blog.favourite_count = actual_count
-    
+    # nothing in the response depends on the counter: batched in the background
+    counters.bump_later(id, favourite_count=-1)
+    related.related_updater.mark(id)
 
     return {'info': 'Removed form favorite!!'}
 
 
 @router.get('/history/view', response_model=List[HistoryOut])
-def my_history(skip: int = 0, limit: int = 10, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    history = db.query(models.History).filter(
+def my_history(response: Response, cursor: Optional[str] = CursorQuery, limit: int = LimitQuery,
+            db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
+    history = db.query(
+        models.History.blog_id,
+        models.Blog.title.label('blog_title'),
+        models.History.viewed_at,
+    ).join(models.Blog, models.Blog.id == models.History.blog_id).filter(
         models.History.user_id == current_user.id
-    ).join(models.Blog).options(
-        joinedload(models.Blog.title)
-    ).order_by(
-        models.History.viewed_at.desc()
-    ).offset(skip).limit(limit).all()
+    )
 
+    history, next_cursor = paginate(history, [models.History.viewed_at, models.History.blog_id], cursor, limit)
+    set_next_cursor(response, next_cursor)
     return history
 
 @router.delete('/history/delete')
 def delete_history(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    history = db.query(models.History).filter(
-        models.History.user_id == current_user.id
-    )
+    # one DELETE (history.py), plus the views still buffered in memory
+    deleted = clear_history(db, current_user.id) + view_buffer.forget(current_user.id)
 
-    if not history.first():
+    if not deleted:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Your history is empty!!!')
-    
-    db.delete(history)
+
     db.commit()
 
     return {'info': 'history deleted!!'}
\ No newline at end of file
@@ -1,5 +1,5 @@
 from typing import List, Optional
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, ConfigDict, field_validator
 from datetime import datetime
 
 class BlogIn(BaseModel):
@@ -16,6 +16,11 @@ class BlogIn(BaseModel):
         return v
     
 
+class BlogImport(BlogIn):
+    # one line of POST /blog/bulk
+    time_created: Optional[datetime] = None
+
+
 class BlogOut(BaseModel):
     id: int
     title: str
@@ -28,15 +33,22 @@ class BlogOut(BaseModel):
     category_name: Optional[str] = None
     tags:Optional[List[str]] = None
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
     @field_validator("tags", mode="before")
     @classmethod
     def extract_tag_names(cls, v):
         if v is None:
             return None
-        return [tag.name for tag in v]  # Auto-convert List[Tag] → List[str]
+        return [getattr(tag, "name", tag) for tag in v]  # Auto-convert List[Tag] → List[str]
+
+
+class ViewerState(BaseModel):
+    # what the current user did with a blog, for rendering feeds
+    blog_id: int
+    liked: bool
+    favorited: bool
+    viewed_at: Optional[datetime] = None
 
 
 class BlogInDB(BaseModel):
@@ -1,5 +1,5 @@
 from typing import List
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from datetime import datetime
 
 
@@ -9,8 +9,7 @@ class Comment(BaseModel):
     time_created: datetime
     created_by: int
     
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class CommentIn(BaseModel):
     body: str
@@ -22,8 +21,7 @@ class CommentOut(BaseModel):
     time_updated: datetime
     commenter_id: int
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class CommentInDB(BaseModel):
@@ -1,5 +1,5 @@
 from typing import List
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from datetime import datetime
 
 class Like(BaseModel):
@@ -7,3 +7,5 @@ class Like(BaseModel):
     blog_id : int
     time_liked : datetime
 
+    model_config = ConfigDict(from_attributes=True)
+
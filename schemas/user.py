@@ -1,5 +1,5 @@
 from typing import Optional
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, ConfigDict, EmailStr
 
 class User(BaseModel):
     username: str
@@ -18,7 +18,8 @@ class UserOut(BaseModel):
     firstname: Optional[str] = None
     lastname: Optional[str] = None
     location: Optional[str] = None
-    
+
+    model_config = ConfigDict(from_attributes=True)
 
 
 class UserInDB(BaseModel):
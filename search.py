@@ -0,0 +1,151 @@
+'''
+Full-text search over blogs (SQLite FTS5).
+
+`blog_fts` holds one row per blog (rowid = blogs.id) with its title, body,
+category name and tag names. The blog, tag and category routers keep it in
+sync inside their own transactions; `python search.py rebuild` rebuilds it
+from scratch. Results are ranked with BM25, title matches weighing most,
+and paged with a cursor on (rank, id) like the other listings: a page
+starts after the last (rank, id) of the previous one instead of skipping
+rows. Ranks depend on the whole index, so new posts can still move results
+between pages, but none is repeated or skipped within one ranking.
+
+Other backends fall back to a LIKE scan of title and body, newest first.
+'''
+import re
+
+from sqlalchemy import Float, Integer, bindparam, column, or_, text
+
+import models
+from pagination import decode_cursor, encode_cursor, paginate
+
+FTS_TABLE = "blog_fts"
+
+# bm25 column weights: title, body, category, tags
+BM25_WEIGHTS = (10.0, 1.0, 2.0, 4.0)
+# the cursor's values, best match first (bm25 is lower for better matches)
+CURSOR_COLUMNS = (column("score", Float), column("rowid", Integer))
+
+CREATE_INDEX = text(f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE}
+    USING fts5(title, body, category, tags, tokenize = 'porter unicode61')
+""")
+
+INDEX_SELECT = """
+    INSERT INTO {fts}(rowid, title, body, category, tags)
+    SELECT blogs.id, blogs.title, blogs.body, coalesce(catagories.name, ''),
+           coalesce((SELECT group_concat(tags.name, ' ')
+                     FROM blog_tag JOIN tags ON tags.id = blog_tag.tag_id
+                     WHERE blog_tag.blog_id = blogs.id), '')
+    FROM blogs LEFT JOIN catagories ON catagories.id = blogs.category_id
+""".format(fts=FTS_TABLE)
+
+
+def is_supported(db) -> bool:
+    return db.bind.dialect.name == "sqlite"
+
+
+def ensure_index(connection) -> bool:
+    # creates the table and fills it from existing blogs (migrations.py)
+    if connection.dialect.name != "sqlite":
+        return False
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": FTS_TABLE}
+    ).first()
+    if exists:
+        return False
+    connection.execute(CREATE_INDEX)
+    connection.execute(text(INDEX_SELECT))
+    return True
+
+
+def index_blogs(db, blog_ids):
+    # (re)index the given blogs, in the caller's transaction
+    if not is_supported(db) or not blog_ids:
+        return
+    remove_blogs(db, blog_ids)
+    db.execute(
+        text(f"{INDEX_SELECT} WHERE blogs.id IN :ids").bindparams(bindparam("ids", expanding=True)),
+        {"ids": list(blog_ids)},
+    )
+
+
+def remove_blogs(db, blog_ids):
+    if not is_supported(db) or not blog_ids:
+        return
+    db.execute(
+        text(f"DELETE FROM {FTS_TABLE} WHERE rowid IN :ids").bindparams(bindparam("ids", expanding=True)),
+        {"ids": list(blog_ids)},
+    )
+
+
+def rebuild(db):
+    db.execute(text(f"DROP TABLE IF EXISTS {FTS_TABLE}"))
+    db.execute(CREATE_INDEX)
+    db.execute(text(INDEX_SELECT))
+    db.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')"))
+
+
+def match_expression(search_query: str) -> str:
+    # every word must match (prefix match on the last one); quoting keeps
+    # user input from being parsed as FTS5 query syntax
+    words = re.findall(r"\w+", search_query)
+    terms = ['"{}"'.format(word) for word in words]
+    if terms:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+def search(db, search_query: str, cursor: str = None, limit: int = 10):
+    # -> (blogs, next_cursor)
+    if not is_supported(db):
+        pattern = f"%{search_query}%"
+        query = db.query(models.Blog).options(*models.blog_out_options).filter(
+            or_(models.Blog.title.ilike(pattern), models.Blog.body.ilike(pattern))
+        )
+        return paginate(query, [models.Blog.time_created, models.Blog.id], cursor, limit)
+
+    expression = match_expression(search_query)
+    if not expression:
+        return [], None
+
+    after, params = "", {"expression": expression, "limit": limit + 1}
+    if cursor:
+        params["score"], params["rowid"] = decode_cursor(cursor, CURSOR_COLUMNS)
+        after = "WHERE (score, rowid) > (:score, :rowid)"
+    weights = ", ".join(str(weight) for weight in BM25_WEIGHTS)
+    rows = db.execute(
+        text(f"""
+            SELECT score, rowid FROM (
+                SELECT bm25({FTS_TABLE}, {weights}) AS score, rowid FROM {FTS_TABLE}
+                WHERE {FTS_TABLE} MATCH :expression
+            )
+            {after}
+            ORDER BY score, rowid
+            LIMIT :limit
+        """),
+        params,
+    ).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(list(rows[-1]))
+    ids = [rowid for _, rowid in rows]
+    blogs = {blog.id: blog for blog in db.query(models.Blog).options(*models.blog_out_options).filter(models.Blog.id.in_(ids))}
+    return [blogs[blog_id] for blog_id in ids if blog_id in blogs], next_cursor
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="blog full-text search index")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.parse_args()
+
+    with SessionLocal() as db:
+        rebuild(db)
+        db.commit()
+        print(f"{FTS_TABLE} rebuilt: {db.query(models.Blog).count()} blogs")
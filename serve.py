@@ -0,0 +1,62 @@
+'''
+Multi-worker launcher.
+
+    python serve.py [--workers N] [--host 127.0.0.1] [--port 8000]
+
+Runs N uvicorn worker processes, by default WEB_CONCURRENCY or one per CPU
+core. Pending migrations are applied once here instead of in every worker,
+and the workers share a WORKER_DIR (a fresh temporary directory unless one
+is given) that they use to:
+
+- send each other cache invalidations (invalidation.py) over Unix sockets,
+  or over Redis with INVALIDATION=redis
+- elect the one worker that runs the database-wide maintenance jobs
+  (jobs.py)
+
+`uvicorn main:app` still runs a single process with none of this.
+'''
+import argparse
+import os
+import shutil
+import tempfile
+
+
+def default_workers() -> int:
+    return int(os.getenv("WEB_CONCURRENCY", "0")) or os.cpu_count() or 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="run the API with several worker processes")
+    parser.add_argument("--workers", type=int, default=default_workers())
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    created = not os.getenv("WORKER_DIR")
+    worker_dir = os.getenv("WORKER_DIR") or tempfile.mkdtemp(prefix="blog-api-")
+    os.makedirs(worker_dir, exist_ok=True)
+    # read by config.py, here and in the workers, which inherit it
+    os.environ["WORKER_DIR"] = worker_dir
+
+    import uvicorn
+
+    from config import AUTO_MIGRATE
+    from database import engine
+    import migrations
+
+    if AUTO_MIGRATE:
+        applied = migrations.upgrade(engine)
+        if applied:
+            print(f"applied migrations {applied}")
+        os.environ["AUTO_MIGRATE"] = "0"    # the workers only check the version
+    engine.dispose()
+
+    try:
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers)
+    finally:
+        if created:
+            shutil.rmtree(worker_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+'''
+NDJSON streaming for list endpoints.
+
+`?stream=1` or `Accept: application/x-ndjson` makes a list endpoint send
+every matching row, one JSON object per line, instead of a page. Rows are
+fetched STREAM_BATCH_SIZE at a time (yield_per) and serialized as they
+arrive, so memory stays flat and the first bytes go out after the first
+batch whatever the size of the result.
+
+The rows are read on a session of their own: the request's session is
+closed before the response body is sent.
+'''
+from fastapi import Query, Request
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter
+
+from database import ReadSessionLocal
+
+NDJSON = "application/x-ndjson"
+STREAM_BATCH_SIZE = 500
+
+StreamQuery = Query(False, description="send every row as NDJSON (also with Accept: application/x-ndjson)")
+
+
+def wants_stream(request: Request, stream: bool = False) -> bool:
+    return stream or NDJSON in request.headers.get("accept", "")
+
+
+def stream_query(query, schema, batch_size: int = STREAM_BATCH_SIZE) -> StreamingResponse:
+    # `query` is an ORM Query, re-bound to the streaming session
+    adapter = TypeAdapter(schema)
+
+    def lines():
+        with ReadSessionLocal() as db:
+            chunk = []
+            for row in query.with_session(db).yield_per(batch_size):
+                chunk.append(adapter.dump_json(adapter.validate_python(row, from_attributes=True)))
+                if len(chunk) >= batch_size:
+                    yield b"\n".join(chunk) + b"\n"
+                    chunk = []
+            if chunk:
+                yield b"\n".join(chunk) + b"\n"
+
+    return StreamingResponse(lines(), media_type=NDJSON)
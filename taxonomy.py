@@ -0,0 +1,154 @@
+'''
+Tag and category name -> id resolution for blog writes.
+
+Names are looked up in an in-process cache first, the misses with a single
+`WHERE name IN (...)` query, and whatever is still missing is created with
+one bulk insert-or-ignore (a concurrent writer may create the same name)
+followed by one more IN query for the new ids. Resolving any number of names
+therefore costs at most three round trips, and none once they are cached
+(one for tags, see `resolve_tags`).
+
+Only ids read back from committed rows are cached; routers/tag.py and
+routers/category.py update the cache when they add or delete names, and
+deletions reach the other workers through invalidation.channel.
+
+`remove_blog_tags` runs on the job runner after blogs are deleted: it drops
+their blog_tag rows and the tags no blog uses anymore. A writer may still
+hold such a tag's id in its cache, and SQLite doesn't enforce blog_tag's
+foreign key, so `resolve_tags` writes the cached tags back with an
+insert-or-ignore in the writer's transaction, and the delete only removes
+tags that are still unused when it runs.
+'''
+from sqlalchemy import delete, exists, select
+
+from cache import TTLCache, response_cache
+from config import TAXONOMY_CACHE_SIZE, TAXONOMY_CACHE_TTL
+from database import SessionLocal, insert_ignore
+from invalidation import channel
+import models
+
+tag_ids = TTLCache(maxsize=TAXONOMY_CACHE_SIZE, ttl=TAXONOMY_CACHE_TTL)
+category_ids = TTLCache(maxsize=TAXONOMY_CACHE_SIZE, ttl=TAXONOMY_CACHE_TTL)
+
+
+def normalize_tags(names) -> list:
+    # stripped, lower case, no blanks, no duplicates, in the given order
+    return list(dict.fromkeys(name.strip().lower() for name in names or [] if name.strip()))
+
+
+def _lookup(db, model, names) -> dict:
+    return dict(db.execute(select(model.name, model.id).where(model.name.in_(names))).all())
+
+
+def _resolve(db, model, cache, names, restore: bool = False) -> dict:
+    ids = {}
+    missing = []
+    for name in names:
+        cached = cache.get(name)
+        if cached is None:
+            missing.append(name)
+        else:
+            ids[name] = cached
+
+    if restore and ids:
+        # a no-op unless the row was deleted since it was cached
+        insert_ignore(db, model.__table__, [{"id": id, "name": name} for name, id in ids.items()])
+
+    if missing:
+        found = _lookup(db, model, missing)
+        for name, id in found.items():
+            cache.set(name, id)
+        ids.update(found)
+
+        new = [name for name in missing if name not in found]
+        if new:
+            insert_ignore(db, model.__table__, [{"name": name} for name in new])
+            ids.update(_lookup(db, model, new))     # not cached until committed
+
+    return ids
+
+
+def _find(db, model, cache, name):
+    # id of an existing name, or None; never creates it
+    id = cache.get(name)
+    if id is None:
+        id = _lookup(db, model, [name]).get(name)
+        if id is not None:
+            cache.set(name, id)
+    return id
+
+
+def find_tag(db, name: str):
+    normalized = normalize_tags([name])
+    return _find(db, models.Tag, tag_ids, normalized[0]) if normalized else None
+
+
+def find_category(db, name: str):
+    return _find(db, models.Category, category_ids, name.strip()) if name.strip() else None
+
+
+def resolve_tags(db, names) -> dict:
+    # -> {name: tag_id}, creating the missing tags (and the cached ones
+    # remove_blog_tags deleted meanwhile)
+    return _resolve(db, models.Tag, tag_ids, names, restore=True)
+
+
+def resolve_categories(db, names) -> dict:
+    # -> {name: category_id}, creating the missing categories
+    return _resolve(db, models.Category, category_ids, names)
+
+
+def resolve_category(db, name):
+    if name is None or not name.strip():
+        return None
+    name = name.strip()
+    return resolve_categories(db, [name])[name]
+
+
+def remember_tag(name: str, id: int):
+    tag_ids.set(name, id)
+
+
+def _drop_tags(*names):
+    for name in names:
+        tag_ids.pop(name)
+
+
+def forget_tags(names):
+    _drop_tags(*names)
+    channel.publish("tags", *names)
+
+
+def remember_category(name: str, id: int):
+    category_ids.set(name, id)
+
+
+def _drop_categories(*names):
+    for name in names:
+        category_ids.pop(name)
+
+
+def forget_categories(names):
+    _drop_categories(*names)
+    channel.publish("categories", *names)
+
+
+def remove_blog_tags(blog_ids):
+    blog_tag, tags = models.blog_tag, models.Tag.__table__
+    with SessionLocal() as db:
+        tag_ids = set(db.execute(select(blog_tag.c.tag_id).where(blog_tag.c.blog_id.in_(blog_ids))).scalars())
+        db.execute(delete(blog_tag).where(blog_tag.c.blog_id.in_(blog_ids)))
+        unused = (tags.c.id.in_(tag_ids), ~exists().where(blog_tag.c.tag_id == tags.c.id))
+        names = db.execute(select(tags.c.name).where(*unused)).scalars().all()
+        if names:
+            # checked again by the delete itself: a writer may have tagged a
+            # blog with one of them since
+            db.execute(delete(tags).where(*unused))
+        db.commit()
+    if names:
+        forget_tags(names)
+        response_cache.invalidate("tags")
+
+
+channel.subscribe("tags", _drop_tags)
+channel.subscribe("categories", _drop_categories)
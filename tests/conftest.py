@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# a throwaway database, set before config.py is imported
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="blog-api-test-"), "test.sqlite3")
+# tests count the work of the handlers, not of the response cache
+os.environ["RESPONSE_CACHE"] = "off"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
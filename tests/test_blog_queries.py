@@ -0,0 +1,54 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from database import engine
+import main
+import migrations
+
+
+@pytest.fixture(scope="module")
+def client():
+    migrations.upgrade(engine)
+    # no lifespan: nothing runs in the background between requests
+    client = TestClient(main.app)
+    client.post("/auth/create", json={"username": "reader", "password": "pw", "email": "reader@example.com"})
+    token = client.post("/auth/login", data={"username": "reader", "password": "pw"}).json()["access_token"]
+    client.headers["Authorization"] = f"Bearer {token}"
+    for n in range(120):
+        blog = {"title": f"blog {n}", "body": "body", "tags": [f"tag{n % 7}", f"tag{n % 3}"], "category_name": f"cat{n % 4}"}
+        assert client.post("/blog/create", json=blog).status_code == 201
+    for blog_id in range(1, 120, 5):
+        assert client.post(f"/like/{blog_id}/like", params={"id": blog_id}).status_code == 200
+        assert client.post(f"/comments/{blog_id}/add-comment", json={"body": "comment"}).status_code in (200, 201)
+    return client
+
+
+def count_statements(request) -> int:
+    statements = []
+
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        response = request()
+    finally:
+        event.remove(Engine, "before_cursor_execute", before_cursor_execute)
+    assert response.status_code == 200
+    return len(statements)
+
+
+def test_blog_list_query_count_does_not_grow_with_the_page(client):
+    client.get("/blog/all", params={"limit": 1})     # authenticates and caches the user
+
+    counts = {
+        limit: count_statements(lambda: client.get("/blog/all", params={"limit": limit}))
+        for limit in (1, 10, 100)
+    }
+    assert len(set(counts.values())) == 1, counts
+
+    page = client.get("/blog/all", params={"limit": 100}).json()
+    assert len(page) == 100
+    assert all(blog["tags"] and blog["category_name"] for blog in page)
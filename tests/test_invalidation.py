@@ -0,0 +1,44 @@
+import socket
+import threading
+import time
+
+from invalidation import SocketChannel
+
+
+def test_socket_channel_delivers_a_burst(tmp_path):
+    sender, receiver = SocketChannel(str(tmp_path)), SocketChannel(str(tmp_path))
+    received = []
+    done = threading.Event()
+
+    def handler(n):
+        time.sleep(0.001)       # slower than the sender: its queue fills up
+        received.append(n)
+        if len(received) == 200:
+            done.set()
+
+    receiver.subscribe("test", handler)
+    receiver.start()
+    sender.start()
+    try:
+        for n in range(200):
+            sender.publish("test", n)
+        assert done.wait(10)
+    finally:
+        sender.stop()
+        receiver.stop()
+    assert received == list(range(200))
+
+
+def test_publish_does_not_wait_for_a_hung_worker(tmp_path):
+    hung = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)     # bound, never read
+    hung.bind(str(tmp_path / "worker-hung.sock"))
+    sender = SocketChannel(str(tmp_path))
+    sender.start()
+    try:
+        started = time.perf_counter()
+        for n in range(50):
+            sender.publish("test", n)
+        assert time.perf_counter() - started < 0.5
+    finally:
+        hung.close()        # the sender's pending sends fail fast now
+        sender.stop()
@@ -0,0 +1,109 @@
+'''
+Trending blogs (the blog_trending read model behind /blog/trending).
+
+A blog's score only depends on its own counters and creation time:
+
+    score = log10(1 + views + 5 likes + 10 comments + 8 favourites)
+            + time_created / TRENDING_DECAY
+
+so a post TRENDING_DECAY seconds newer needs 10x less engagement to rank
+the same. Unlike a decay computed against "now", scores never go stale
+with time and only change when a counter does. Writers mark the blogs they
+touch (`trending_updater.mark`); a background job (dirty.py) recomputes
+just those every TRENDING_INTERVAL seconds, one bulk upsert per batch.
+Pages are served from the (score, blog_id) index with keyset pagination
+and cached under the "trending" response cache tag, which every run that
+changed scores bumps.
+
+`python trending.py rebuild` recomputes every blog.
+'''
+import math
+from datetime import timezone
+
+from sqlalchemy import delete, func, select
+
+from cache import response_cache
+from config import TRENDING_DECAY, TRENDING_INTERVAL
+from database import SessionLocal, upsert
+from dirty import DirtyUpdater
+from pagination import paginate
+import models
+
+trending = models.blog_trending
+blogs = models.Blog.__table__
+
+WEIGHTS = {"view_count": 1, "likes_count": 5, "comments_count": 10, "favourite_count": 8}
+BATCH_SIZE = 1000
+
+
+def score(row) -> float:
+    engagement = sum(weight * (getattr(row, name) or 0) for name, weight in WEIGHTS.items())
+    created = row.time_created.replace(tzinfo=timezone.utc).timestamp() if row.time_created else 0
+    return math.log10(1 + max(engagement, 0)) + created / TRENDING_DECAY
+
+
+def _score_rows(connection, where):
+    rows = connection.execute(
+        select(blogs.c.id, blogs.c.time_created, *[blogs.c[name] for name in WEIGHTS]).where(where)
+    ).all()
+    return [{"blog_id": row.id, "score": score(row)} for row in rows]
+
+
+def update(connection, blog_ids) -> int:
+    # recompute the scores of the given blogs, in the caller's transaction
+    blog_ids = list(blog_ids)
+    updated = 0
+    for start in range(0, len(blog_ids), BATCH_SIZE):
+        rows = _score_rows(connection, blogs.c.id.in_(blog_ids[start:start + BATCH_SIZE]))
+        if rows:
+            upsert(connection, trending, rows, index_elements=["blog_id"], update_columns=["score"])
+        updated += len(rows)
+    return updated
+
+
+def remove_blogs(db, blog_ids):
+    if blog_ids:
+        db.execute(delete(trending).where(trending.c.blog_id.in_(list(blog_ids))))
+
+
+def rebuild(connection) -> int:
+    connection.execute(delete(trending))
+    last_id = connection.execute(select(func.max(blogs.c.id))).scalar() or 0
+    count = 0
+    for start in range(0, last_id, BATCH_SIZE):
+        rows = _score_rows(connection, (blogs.c.id > start) & (blogs.c.id <= start + BATCH_SIZE))
+        if rows:
+            connection.execute(trending.insert(), rows)
+        count += len(rows)
+    return count
+
+
+def page(db, cursor: str = None, limit: int = 10, exclude=None):
+    # -> (blog ids, highest score first, next_cursor); `exclude` is a select
+    # of blog ids to leave out
+    query = db.query(trending.c.score, trending.c.blog_id)
+    if exclude is not None:
+        query = query.filter(trending.c.blog_id.not_in(exclude))
+    rows, next_cursor = paginate(query, [trending.c.score, trending.c.blog_id], cursor, limit)
+    return [row.blog_id for row in rows], next_cursor
+
+
+def invalidate():
+    response_cache.invalidate("trending")
+
+
+trending_updater = DirtyUpdater("trending-updater", update, TRENDING_INTERVAL, after_commit=invalidate)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="trending blog scores")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.parse_args()
+
+    with SessionLocal() as db:
+        count = rebuild(db)
+        db.commit()
+        invalidate()    # reaches the workers with RESPONSE_CACHE=redis; in-process entries age out
+        print(f"{trending.name} rebuilt: {count} blogs")
@@ -0,0 +1,119 @@
+'''
+Buffered view counting for GET /blog/get.
+
+Reading a blog only records the view in memory. The buffer is flushed on
+the job runner (jobs.py) every VIEW_FLUSH_INTERVAL seconds, or as soon as
+VIEW_FLUSH_SIZE history rows are pending, as one bulk UPDATE of blogs.view_count and one
+bulk upsert of history per batch. Counts are eventually consistent, and
+views still buffered when the process is killed (not stopped) are lost.
+'''
+import logging
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+
+from sqlalchemy import bindparam, select, tuple_, update
+
+from config import VIEW_FLUSH_INTERVAL, VIEW_FLUSH_SIZE
+from database import SessionLocal, upsert
+from jobs import runner
+import models
+from related import related_updater
+from trending import trending_updater
+
+logger = logging.getLogger(__name__)
+
+
+class ViewBuffer:
+
+    def __init__(self, flush_interval: float = VIEW_FLUSH_INTERVAL, flush_size: int = VIEW_FLUSH_SIZE):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._views = Counter()         # blog_id -> views not flushed yet
+        self._history = {}              # (user_id, blog_id) -> last viewed_at
+        self._lock = threading.Lock()
+        self._flush_queued = False
+
+    def record(self, user_id: int, blog_id: int):
+        now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)    # same as CURRENT_TIMESTAMP
+        with self._lock:
+            self._views[blog_id] += 1
+            self._history[(user_id, blog_id)] = now
+            flush = len(self._history) >= self.flush_size and not self._flush_queued
+            if flush:
+                self._flush_queued = True
+        if flush:
+            runner.submit("view-flush", self.flush)
+
+    def pending(self, user_id: int, blog_ids) -> dict:
+        # {blog_id: viewed_at} of this user's views not flushed yet
+        with self._lock:
+            return {
+                blog_id: self._history[(user_id, blog_id)]
+                for blog_id in blog_ids if (user_id, blog_id) in self._history
+            }
+
+    def forget(self, user_id: int) -> int:
+        # drop this user's history rows not flushed yet (view counts stay)
+        with self._lock:
+            keys = [key for key in self._history if key[0] == user_id]
+            for key in keys:
+                del self._history[key]
+        return len(keys)
+
+    def _take(self):
+        with self._lock:
+            views, self._views = self._views, Counter()
+            history, self._history = self._history, {}
+            self._flush_queued = False
+        return views, history
+
+    def _put_back(self, views, history):
+        with self._lock:
+            self._views.update(views)
+            for key, viewed_at in history.items():
+                self._history[key] = max(viewed_at, self._history.get(key, viewed_at))
+
+    def flush(self) -> int:
+        views, history = self._take()
+        if not views:
+            return 0
+
+        blogs = models.Blog.__table__
+        history_table = models.History.__table__
+        try:
+            with SessionLocal() as db:
+                db.execute(
+                    update(blogs)
+                    .where(blogs.c.id == bindparam("b_id"))
+                    .values(view_count=blogs.c.view_count + bindparam("n")),
+                    [{"b_id": blog_id, "n": n} for blog_id, n in views.items()],
+                )
+                # empty when the viewers cleared their history meanwhile
+                seen = set()
+                if history:
+                    # first views of a blog by a user change its related blogs
+                    seen = set(db.execute(
+                        select(history_table.c.user_id, history_table.c.blog_id)
+                        .where(tuple_(history_table.c.user_id, history_table.c.blog_id).in_(list(history)))
+                    ).tuples())
+                    upsert(
+                        db,
+                        history_table,
+                        [{"user_id": user_id, "blog_id": blog_id, "viewed_at": viewed_at}
+                         for (user_id, blog_id), viewed_at in history.items()],
+                        index_elements=["user_id", "blog_id"],
+                        update_columns=["viewed_at"],
+                    )
+                db.commit()
+            trending_updater.mark(*views)
+            related_updater.mark(*{blog_id for user_id, blog_id in history.keys() - seen})
+        except Exception:
+            logger.exception("flushing %d blog views failed, will retry", sum(views.values()))
+            self._put_back(views, history)
+            return 0
+
+        return len(views)
+
+
+view_buffer = ViewBuffer()